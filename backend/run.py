@@ -1,6 +1,6 @@
 from src.app import app
 from src.db import engine, Session
-from src.models import Base
+from src.models import Base, init_db, require_attendance_schema
 
 
 # create all the required tables from `src/models.py` before app's first request
@@ -18,4 +18,7 @@ def cleanup(resp_or_exc):
 
 
 if __name__ == "__main__":
+    init_db()
+    # the attendance queries need the migrated schema
+    require_attendance_schema()
     app.run(host='0.0.0.0', port=5000, threaded=True)
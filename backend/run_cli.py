@@ -2,15 +2,11 @@ import os
 
 import pyfiglet
 
-from src.db import engine
 from src.libs.train_classifier import TrainClassifier
-from src.models import Base
+from src.models import init_db, require_attendance_schema
 from src.settings import VIDEO_SOURCE
 from src.libs.cli_utils import CliAppUtils
 
-# create database tables
-Base.metadata.create_all(engine)
-
 # input live stream from a recorder
 # VIDEO_SOURCE = "http://192.168.1.100:8080/video"
 
@@ -76,4 +72,7 @@ def main_menu():
 
 # --------------- run the main function ------------------
 if __name__ == "__main__":
+    # create database tables
+    init_db()
+    require_attendance_schema()
     main_menu()
@@ -0,0 +1,132 @@
+import argparse
+import random
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy import inspect, text
+
+from src.db import engine
+from src.models import AttendanceModel, needs_attendance_migration
+
+OLD_TABLE = "attendances_old"  # the old rows while they are copied
+BACKUP_TABLE = "attendances_backup"  # the old rows when kept after the migration
+
+# the lookups the application makes, on the old schema (day derived from `date`) and on the new one
+OLD_QUERIES = {
+    "is marked": "SELECT 1 FROM attendances WHERE date(date) = :day AND student_id = :student_id LIMIT 1",
+    "present on day": "SELECT DISTINCT student_id FROM attendances WHERE date(date) = :day",
+    "student history": "SELECT date FROM attendances WHERE student_id = :student_id ORDER BY date",
+}
+NEW_QUERIES = {
+    "is marked": "SELECT 1 FROM attendances WHERE day = :day AND student_id = :student_id LIMIT 1",
+    "present on day": "SELECT student_id FROM attendances WHERE day = :day",
+    "student history": "SELECT date FROM attendances WHERE student_id = :student_id ORDER BY day",
+}
+
+
+def benchmark(queries: Dict[str, str], samples: List[Dict], repeat: int) -> Dict[str, float]:
+    """Mean time in ms of every query over the sampled (day, student) parameters"""
+    timings = {}
+    with engine.connect() as connection:
+        for name, sql in queries.items():
+            statement = text(sql)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for parameters in samples:
+                    connection.execute(statement, parameters).fetchall()
+            timings[name] = (time.perf_counter() - started) * 1000 / (repeat * max(len(samples), 1))
+    return timings
+
+
+def sample_parameters(day_sql: str, count: int, seed: int = 0) -> List[Dict]:
+    """(day, student) pairs of existing attendances, so the benchmark looks up realistic rows"""
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            f"SELECT {day_sql}, student_id FROM attendances WHERE student_id IS NOT NULL"
+        )).fetchall()
+    rows = random.Random(seed).sample(rows, min(count, len(rows)))
+    return [{"day": str(day), "student_id": student_id} for day, student_id in rows]
+
+
+def copy_batches(batch_size: int, report: Callable[[int, int], None]) -> int:
+    """
+    Copy the old rows into the new table in `date` order, one transaction per batch. The earliest mark
+    of a student per day is kept. Starts after the last copied row, so an interrupted run resumes.
+    """
+    copied = 0
+    with engine.connect() as connection:
+        total = connection.execute(text(f"SELECT count(*) FROM {OLD_TABLE}")).scalar()
+        last = connection.execute(text("SELECT max(date) FROM attendances")).scalar()
+    while True:
+        with engine.begin() as connection:
+            # `date` was the primary key of the old table, so it is unique and indexed
+            upper = connection.execute(text(
+                f"SELECT max(date) FROM (SELECT date FROM {OLD_TABLE} WHERE :last IS NULL OR date > :last "
+                f"ORDER BY date LIMIT :limit)"
+            ), {"last": last, "limit": batch_size}).scalar()
+            if upper is None:
+                return copied
+            connection.execute(text(
+                f"INSERT OR IGNORE INTO attendances (date, day, student_id) "
+                f"SELECT date, date(date), student_id FROM {OLD_TABLE} "
+                f"WHERE (:last IS NULL OR date > :last) AND date <= :upper AND student_id IS NOT NULL "
+                f"ORDER BY date"
+            ), {"last": last, "upper": upper})
+            copied += connection.execute(text(
+                f"SELECT count(*) FROM {OLD_TABLE} WHERE (:last IS NULL OR date > :last) AND date <= :upper"
+            ), {"last": last, "upper": upper}).scalar()
+        last = upper
+        report(copied, total)
+
+
+def migrate(args):
+    if engine.dialect.name != "sqlite":
+        raise SystemExit(f"[ERROR] only SQLite databases are converted in place, not {engine.dialect.name}")
+    tables = inspect(engine).get_table_names()
+    resuming = OLD_TABLE in tables
+    if not resuming and not needs_attendance_migration():
+        print("[INFO] the attendances table has the new schema already")
+        return
+
+    if not resuming:
+        samples = sample_parameters("date(date)", args.samples)
+        before = benchmark(OLD_QUERIES, samples, args.repeat)
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE attendances RENAME TO {OLD_TABLE}"))
+            AttendanceModel.__table__.create(connection)
+    else:
+        print(f"[INFO] resuming the copy from {OLD_TABLE}")
+        samples, before = None, None
+
+    started = time.perf_counter()
+    copied = copy_batches(args.batch_size, lambda done, total: print(f"[INFO] copied {done}/{total} rows"))
+    with engine.begin() as connection:
+        kept = connection.execute(text("SELECT count(*) FROM attendances")).scalar()
+        old = connection.execute(text(f"SELECT count(*) FROM {OLD_TABLE}")).scalar()
+        if args.keep_old:
+            connection.execute(text(f"ALTER TABLE {OLD_TABLE} RENAME TO {BACKUP_TABLE}"))
+        else:
+            connection.execute(text(f"DROP TABLE {OLD_TABLE}"))
+    with engine.connect() as connection:
+        # statistics for the query planner of the new indexes
+        connection.execute(text("ANALYZE attendances"))
+    print(f"[INFO] {copied} rows read, {kept} attendances kept ({old - kept} duplicates of the same student "
+          f"and day or without student dropped) in {time.perf_counter() - started:.2f}s")
+
+    samples = samples or sample_parameters("day", args.samples)
+    after = benchmark(NEW_QUERIES, samples, args.repeat)
+    print(f"{'query':<16} {'before (ms)':>12} {'after (ms)':>11}")
+    for name in NEW_QUERIES:
+        old_ms = f"{before[name]:>12.3f}" if before else f"{'-':>12}"
+        print(f"{name:<16} {old_ms} {after[name]:>11.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert the attendances table to the schema with a surrogate key, a day column and indexes"
+    )
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows copied per transaction")
+    parser.add_argument("--samples", type=int, default=200, help="lookups of the before/after benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep-old", action="store_true", help=f"keep the old rows in {BACKUP_TABLE}")
+    migrate(parser.parse_args())
@@ -0,0 +1,6 @@
+from src.libs.recognition_service import RecognitionService
+
+
+# identifies the faces of every feed and socket client when RECOGNITION_BACKEND=service
+if __name__ == "__main__":
+    RecognitionService().serve_forever()
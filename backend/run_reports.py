@@ -0,0 +1,108 @@
+import os
+import argparse
+from typing import List
+
+import cv2
+import numpy as np
+
+from src.settings import DATASET_PATH, DLIB_MODEL, DLIB_TOLERANCE, ENCODINGS_FILE, FACE_INDEX_K, PROTOTYPE_METHOD
+from src.libs.detectors import FACE_DETECTORS, detector_report
+from src.libs.face_matcher import FaceMatcher, index_report, prototype_report
+from src.libs.train_classifier import TrainClassifier
+
+
+def sample_probes(matcher: FaceMatcher, count: int, noise: float, seed: int = 0) -> np.ndarray:
+    """Probe faces made from random gallery samples with a bit of noise, like a new shot of a known student"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(matcher), size=min(count, len(matcher)), replace=False)
+    probes = matcher.encodings[rows] + rng.normal(scale=noise, size=(len(rows), matcher.encodings.shape[1]))
+    return probes.astype(np.float32)
+
+
+def report_index(args):
+    """Recall and latency of every face index type on the current gallery"""
+    matcher = FaceMatcher.from_file(ENCODINGS_FILE, index="brute")
+    probes = sample_probes(matcher, args.probes, args.noise)
+    print(f"[INFO] gallery: {len(matcher)} encodings of {len(matcher.unique_ids)} students, "
+          f"{len(probes)} probes, k={args.k}")
+    print(f"{'index':<8} {'build (s)':>10} {'query (ms)':>11} {'recall':>8} {'agreement':>10}")
+    for kind, result in index_report(matcher.encodings, matcher.ids, probes, DLIB_TOLERANCE, args.k).items():
+        print(f"{kind:<8} {result['build_s']:>10.3f} {result['query_ms']:>11.3f} {result['recall']:>8.3f} "
+              f"{result['agreement']:>10.3f}")
+
+
+def report_prototypes(args):
+    """Gallery shrink factor and match agreement of per-student prototypes"""
+    matcher = FaceMatcher.from_file(ENCODINGS_FILE, index="brute")
+    probes = sample_probes(matcher, args.probes, args.noise)
+    print(f"[INFO] gallery: {len(matcher)} encodings of {len(matcher.unique_ids)} students, {len(probes)} probes")
+    print(f"{'k':>3} {'shrink':>7} {'agreement':>10} {'reranked':>9} {'full (ms)':>10} {'proto (ms)':>11}")
+    for k in args.k:
+        prototypes, prototype_ids = TrainClassifier.compact(matcher.encodings, matcher.ids, k, args.method)
+        result = prototype_report(matcher, prototypes, prototype_ids, probes)
+        print(f"{k:>3} {result['shrink_factor']:>6.1f}x {result['agreement']:>10.3f} {result['reranked']:>9.3f} "
+              f"{result['full_ms']:>10.3f} {result['prototype_ms']:>11.3f}")
+
+
+def load_images(path: str, count: int) -> List[np.ndarray]:
+    """Up to `count` images of a folder (searched recursively) or frames spread over a video"""
+    images = []
+    if os.path.isdir(path):
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                image = cv2.imread(os.path.join(root, name))
+                if image is not None:
+                    images.append(image)
+                if len(images) >= count:
+                    return images
+        return images
+    cap = cv2.VideoCapture(path)
+    step = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) // count, 1)
+    index = 0
+    while len(images) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index % step == 0:
+            images.append(frame)
+        index += 1
+    cap.release()
+    return images
+
+
+def report_detectors(args):
+    """Time per image and recall of face detectors against a single stage reference detector"""
+    images = load_images(args.path, args.images)
+    print(f"[INFO] {len(images)} images from {args.path}, reference detector {args.reference}")
+    print(f"{'detector':<9} {'ms/image':>9} {'faces':>6} {'recall':>7}")
+    for name, result in detector_report(images, args.detectors, args.reference).items():
+        print(f"{name:<9} {result['ms_per_image']:>9.1f} {result['faces']:>6} {result['recall']:>7.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Performance reports of the attendance system")
+    reports = parser.add_subparsers(dest="report", required=True)
+
+    index_parser = reports.add_parser("index", help=report_index.__doc__)
+    index_parser.add_argument("--probes", type=int, default=500)
+    index_parser.add_argument("--noise", type=float, default=0.02)
+    index_parser.add_argument("--k", type=int, default=FACE_INDEX_K)
+    index_parser.set_defaults(run=report_index)
+
+    prototypes_parser = reports.add_parser("prototypes", help=report_prototypes.__doc__)
+    prototypes_parser.add_argument("--probes", type=int, default=500)
+    prototypes_parser.add_argument("--noise", type=float, default=0.02)
+    prototypes_parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    prototypes_parser.add_argument("--method", choices=("medoid", "kmeans"), default=PROTOTYPE_METHOD)
+    prototypes_parser.set_defaults(run=report_prototypes)
+
+    detectors_parser = reports.add_parser("detectors", help=report_detectors.__doc__)
+    detectors_parser.add_argument("--path", default=DATASET_PATH, help="folder of images or a video file")
+    detectors_parser.add_argument("--images", type=int, default=100)
+    detectors_parser.add_argument("--reference", choices=FACE_DETECTORS, default=DLIB_MODEL)
+    detectors_parser.add_argument("--detectors", choices=FACE_DETECTORS, nargs="+",
+                                  default=[DLIB_MODEL, "haar", "cascade"])
+    detectors_parser.set_defaults(run=report_detectors)
+
+    arguments = parser.parse_args()
+    arguments.run(arguments)
@@ -10,8 +10,10 @@ from src.resources.dashboard import Dashboard
 from src.resources.teacher import Teacher, TeacherRegister, TeacherLogin
 from src.resources.student import StudentList, StudentAdd, StudentCapture, StudentDelete
 from src.resources.attendance import AttendanceList
+from src.resources.training import TrainingJobStatus
 from src.resources.video_feed import (
-    VideoFeedList, VideoFeedAdd, VideoFeed, VideoFeedPreview, VideoFeedStop, VideoFeedStart, VideoFeedDelete
+    VideoFeedList, VideoFeedAdd, VideoFeed, VideoFeedPreview, VideoFeedStop, VideoFeedStart, VideoFeedDelete,
+    VideoFeedStats, VideoFeedRoi
 )
 
 
@@ -39,11 +41,13 @@ api.add_resource(Dashboard, "/dashboard")
 # /video_feed
 api.add_resource(VideoFeedList, "/video_feeds")
 api.add_resource(VideoFeedAdd, "/video_feeds/add")
+api.add_resource(VideoFeedStats, "/video_feeds/stats")
 api.add_resource(VideoFeed, "/video_feeds/<string:feed_id>")
 api.add_resource(VideoFeedPreview, "/video_feeds/preview/<string:feed_id>")
 api.add_resource(VideoFeedStop, "/video_feeds/stop/<string:feed_id>")
 api.add_resource(VideoFeedStart, "/video_feeds/start/<string:feed_id>")
 api.add_resource(VideoFeedDelete, "/video_feeds/delete/<string:feed_id>")
+api.add_resource(VideoFeedRoi, "/video_feeds/roi/<string:feed_id>")
 
 # /students
 api.add_resource(StudentList, "/students")
@@ -53,3 +57,6 @@ api.add_resource(StudentDelete, "/students/delete/<int:student_id>")
 
 # /attendance
 api.add_resource(AttendanceList, "/attendance")
+
+# /training
+api.add_resource(TrainingJobStatus, "/training/jobs/<string:job_id>")
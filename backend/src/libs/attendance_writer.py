@@ -0,0 +1,99 @@
+import atexit
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict
+
+from src.db import Session
+from src.settings import ATTENDANCE_BATCH_SIZE, ATTENDANCE_COMMIT_DELAY_MS, ATTENDANCE_RETRY_MAX_SECONDS
+from src.models import AttendanceModel
+
+
+class AttendanceWriter:
+    """
+    Single writer of attendances. Recognizers queue their marks and go on with the next frame,
+    a background thread writes the queued marks of every feed in one transaction, so a burst of
+    recognitions costs one commit (and one fsync) instead of one per student.
+    Each mark is an insert-if-not-marked-that-day, so duplicates from other processes are ignored.
+    """
+    queue = deque()  # (student id, marked at)
+    condition = threading.Condition()
+    thread = None
+    busy = False  # a batch is being written
+    failures = 0  # consecutive failed batches, the retry delay doubles with each
+    counters = {"written": 0, "ignored": 0, "retried": 0, "batches": 0}
+
+    @classmethod
+    def submit(cls, student_id: int, at: datetime):
+        """Queue the attendance of a student, never waits for the database"""
+        with cls.condition:
+            cls.queue.append((student_id, at))
+            if cls.thread is None or not cls.thread.is_alive():
+                if cls.thread is None:
+                    # marks still queued when the process exits are written before it does
+                    atexit.register(cls.flush)
+                cls.thread = threading.Thread(target=cls._worker, name="attendance-writer", daemon=True)
+                cls.thread.start()
+            cls.condition.notify_all()
+
+    @classmethod
+    def flush(cls, timeout: float = 10.0) -> bool:
+        """Wait until every queued mark is written, returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        with cls.condition:
+            while cls.queue or cls.busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                cls.condition.wait(remaining)
+        return True
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        with cls.condition:
+            return dict(cls.counters, queued=len(cls.queue))
+
+    @classmethod
+    def _worker(cls):
+        while True:
+            with cls.condition:
+                while not cls.queue:
+                    cls.condition.wait()
+            # let the marks of the other feeds join the transaction
+            time.sleep(ATTENDANCE_COMMIT_DELAY_MS / 1000)
+            with cls.condition:
+                batch = [cls.queue.popleft() for _ in range(min(len(cls.queue), ATTENDANCE_BATCH_SIZE))]
+                cls.busy = True
+            written = cls._write(batch)
+            with cls.condition:
+                if not written:
+                    # retried first, a student seen once at the door may never be recognized again
+                    cls.queue.extendleft(reversed(batch))
+                    cls.counters["retried"] += len(batch)
+                cls.busy = False
+                cls.condition.notify_all()
+            if not written:
+                # e.g. "database is locked" while another process writes
+                time.sleep(min(2 ** (cls.failures - 1), ATTENDANCE_RETRY_MAX_SECONDS))
+
+    @classmethod
+    def _write(cls, batch) -> bool:
+        """Write a batch in one transaction, returns False when it has to be retried"""
+        try:
+            inserted = [AttendanceModel.mark_once(student_id, at) for student_id, at in batch]
+            Session.commit()
+        except Exception:
+            traceback.print_exc()
+            Session.rollback()
+            cls.failures += 1
+            return False
+        finally:
+            Session.remove()
+        cls.failures = 0
+        with cls.condition:
+            cls.counters["batches"] += 1
+            cls.counters["written"] += sum(inserted)
+            cls.counters["ignored"] += len(inserted) - sum(inserted)
+        return True
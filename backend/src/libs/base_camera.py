@@ -95,15 +95,15 @@ class BaseCamera(object):
         return BaseCamera.frame[self.unique_id]
 
     @staticmethod
-    def frames():
-        """"Generator that returns frames from the camera."""
+    def frames(unique_id=None):
+        """"Generator that returns frames from the camera of the feed `unique_id`."""
         raise RuntimeError('Must be implemented by subclasses')
 
     @classmethod
     def _thread(cls, unique_id):
         """Camera background thread."""
         print('Starting camera thread')
-        frames_iterator = cls.frames()
+        frames_iterator = cls.frames(unique_id)
         for frame in frames_iterator:
             BaseCamera.frame[unique_id] = frame
             BaseCamera.event[unique_id].set()  # send signal to clients
@@ -0,0 +1,53 @@
+import threading
+from typing import Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+
+class FrameGrabber:
+    """
+    Reads a video source on its own thread and keeps only the latest frame, so the buffers of
+    RTSP/HTTP streams are drained at capture rate and consumers never get a stale frame.
+    """
+
+    def __init__(self, source: Union[int, str]):
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise RuntimeError('Could not start camera.')
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0  # number of the latest frame
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"capture-{source}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while self.running:
+                ok, frame = self.capture.read()
+                if not ok:  # end of the video or camera disconnected
+                    break
+                with self.condition:
+                    self.frame = frame
+                    self.sequence += 1
+                    self.condition.notify_all()
+        finally:
+            self.capture.release()
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def read(self, after: int = 0) -> Tuple[int, Optional[np.ndarray]]:
+        """Wait for a frame newer than `after`, returns its number and the frame (None once stopped)"""
+        with self.condition:
+            while self.running and self.sequence <= after:
+                self.condition.wait()
+            if self.sequence <= after:
+                return self.sequence, None
+            return self.sequence, self.frame
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
@@ -0,0 +1,212 @@
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+import face_recognition
+
+from src.settings import (
+    DLIB_MODEL, HAAR_CASCADE_PATH, PROTOTXT_PATH, CAFFEMODEL_PATH, SSD_CONFIDENCE,
+    CASCADE_PROPOSER, CASCADE_CONFIRMER, CASCADE_PADDING
+)
+
+# (top, right, bottom, left) as returned by face_recognition
+Box = Tuple[int, int, int, int]
+
+
+def clip_box(box: Box, shape: Tuple[int, ...]) -> Box:
+    top, right, bottom, left = box
+    return max(top, 0), min(right, shape[1]), min(bottom, shape[0]), max(left, 0)
+
+
+def iou(a: Box, b: Box) -> float:
+    """Intersection over union of two boxes"""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(right - left, 0) * max(bottom - top, 0)
+    union = (a[1] - a[3]) * (a[2] - a[0]) + (b[1] - b[3]) * (b[2] - b[0]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def non_max_suppression(boxes: List[Box], max_iou: float = 0.3) -> List[Box]:
+    """Drop the boxes overlapping a larger one, e.g. a face found in two overlapping regions"""
+    kept = []
+    for box in sorted(boxes, key=lambda b: (b[1] - b[3]) * (b[2] - b[0]), reverse=True):
+        if all(iou(box, other) < max_iou for other in kept):
+            kept.append(box)
+    return kept
+
+
+class FaceDetector(ABC):
+    """Finds the faces of an RGB image, as (top, right, bottom, left) boxes inside the image"""
+    name = None
+
+    @abstractmethod
+    def __call__(self, rgb: np.ndarray) -> List[Box]:
+        pass
+
+
+class DlibDetector(FaceDetector):
+    """HOG or CNN face detector of dlib, through `face_recognition.face_locations`"""
+
+    def __init__(self, model: str = DLIB_MODEL, upsample: int = 1):
+        self.name = self.model = model
+        self.upsample = upsample
+
+    def __call__(self, rgb: np.ndarray) -> List[Box]:
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=self.upsample, model=self.model)
+
+
+class HaarDetector(FaceDetector):
+    """OpenCV Haar cascade, the fastest and least accurate, mostly frontal faces"""
+    name = "haar"
+
+    def __init__(self, path: str = HAAR_CASCADE_PATH, scale_factor: float = 1.1, min_neighbors: int = 5,
+                 min_size: int = 30):
+        self.classifier = cv2.CascadeClassifier(path)
+        if self.classifier.empty():
+            raise FileNotFoundError(f"Haar cascade not found at {path}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.lock = threading.Lock()
+
+    def __call__(self, rgb: np.ndarray) -> List[Box]:
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        with self.lock:
+            faces = self.classifier.detectMultiScale(
+                gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors,
+                minSize=(self.min_size, self.min_size)
+            )
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in faces]
+
+
+class SsdDetector(FaceDetector):
+    """OpenCV DNN res10 300x300 SSD (Caffe), several times faster than HOG on CPU and robust to pose"""
+    name = "ssd"
+
+    def __init__(self, prototxt: str = PROTOTXT_PATH, caffemodel: str = CAFFEMODEL_PATH,
+                 confidence: float = SSD_CONFIDENCE):
+        for path in (prototxt, caffemodel):
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"SSD face detector model not found at {path}")
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+        self.confidence = confidence
+        # a Net is not safe to run from several threads at once
+        self.lock = threading.Lock()
+
+    def __call__(self, rgb: np.ndarray) -> List[Box]:
+        height, width = rgb.shape[:2]
+        # the model was trained on mean subtracted BGR 300x300 images
+        blob = cv2.dnn.blobFromImage(
+            cv2.resize(rgb, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0), swapRB=True
+        )
+        with self.lock:
+            self.net.setInput(blob)
+            detections = self.net.forward()[0, 0]
+        boxes = []
+        for detection in detections[detections[:, 2] >= self.confidence]:
+            left, top, right, bottom = (detection[3:7] * [width, height, width, height]).astype(int)
+            box = clip_box((int(top), int(right), int(bottom), int(left)), rgb.shape)
+            if box[1] > box[3] and box[2] > box[0]:
+                boxes.append(box)
+        return boxes
+
+
+class CascadeDetector(FaceDetector):
+    """
+    Two stage detection: a fast `proposer` (Haar or SSD) scans the whole frame, the accurate `confirmer`
+    (dlib HOG/CNN) only runs on padded regions around the proposals, so on a wide shot where faces
+    cover a small part of the frame most pixels are never seen by dlib. Faces the proposer misses are
+    missed, `run_reports.py detectors` measures the recall against the single stage detectors.
+    """
+    name = "cascade"
+
+    def __init__(self, proposer: FaceDetector = None, confirmer: FaceDetector = None,
+                 padding: float = CASCADE_PADDING):
+        self.proposer = proposer or create_detector(CASCADE_PROPOSER)
+        self.confirmer = confirmer or create_detector(CASCADE_CONFIRMER)
+        # share of the proposal size added on every side, dlib needs context around a face
+        self.padding = padding
+
+    def regions(self, rgb: np.ndarray) -> List[Box]:
+        """Padded proposals, overlapping ones merged so no face is confirmed twice"""
+        regions = []
+        for top, right, bottom, left in self.proposer(rgb):
+            pad = int(max(bottom - top, right - left) * self.padding)
+            regions.append(clip_box((top - pad, right + pad, bottom + pad, left - pad), rgb.shape))
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[3] < b[1] and b[3] < a[1]:
+                        regions[i] = (min(a[0], b[0]), max(a[1], b[1]), max(a[2], b[2]), min(a[3], b[3]))
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+    def __call__(self, rgb: np.ndarray) -> List[Box]:
+        boxes = []
+        for top, right, bottom, left in self.regions(rgb):
+            crop = np.ascontiguousarray(rgb[top:bottom, left:right])
+            for t, r, b, l in self.confirmer(crop):
+                boxes.append((t + top, r + left, b + top, l + left))
+        return non_max_suppression(boxes)
+
+
+FACE_DETECTORS = ("hog", "cnn", "haar", "ssd", "cascade")
+
+
+def create_detector(name: str = DLIB_MODEL, upsample: int = 1) -> FaceDetector:
+    """New detector by name, `upsample` only applies to the dlib detectors"""
+    if name in ("hog", "cnn"):
+        return DlibDetector(name, upsample)
+    if name == "haar":
+        return HaarDetector()
+    if name == "ssd":
+        return SsdDetector()
+    if name == "cascade":
+        return CascadeDetector(confirmer=create_detector(CASCADE_CONFIRMER, upsample))
+    raise ValueError(f"Unknown face detector {name!r}, expected one of {', '.join(FACE_DETECTORS)}")
+
+
+@lru_cache(maxsize=None)
+def get_detector(name: str = DLIB_MODEL, upsample: int = 1) -> FaceDetector:
+    """Detector shared by the whole process, e.g. in training and recognition worker processes"""
+    return create_detector(name, upsample)
+
+
+def detector_report(images: List[np.ndarray], names: List[str], reference: str = DLIB_MODEL,
+                    min_iou: float = 0.5) -> Dict[str, Dict[str, float]]:
+    """
+    Time per image of every detector and its recall of the faces found by the `reference` detector
+    (a reference face counts as found when a detected box overlaps it by `min_iou`)
+    """
+    rgb_images = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images]
+    reference_boxes = [get_detector(reference)(rgb) for rgb in rgb_images]
+    total = sum(len(boxes) for boxes in reference_boxes)
+    results = {}
+    for name in names:
+        detector = create_detector(name)
+        found = detected = 0
+        start = time.perf_counter()
+        all_boxes = [detector(rgb) for rgb in rgb_images]
+        elapsed = time.perf_counter() - start
+        for boxes, expected in zip(all_boxes, reference_boxes):
+            detected += len(boxes)
+            found += sum(any(iou(box, other) >= min_iou for other in boxes) for box in expected)
+        results[name] = {
+            "ms_per_image": elapsed * 1000 / max(len(images), 1),
+            "faces": detected,
+            "recall": found / total if total else 1.0,
+        }
+    return results
@@ -0,0 +1,117 @@
+"""
+libs.encodings_store
+
+Versioned binary file holding the known face encodings, laid out so every process can map it with
+`numpy.memmap` instead of deserializing it:
+
+    header  (64 bytes)  magic, version, dtype, dimension, count, model name
+    matrix  (count x dimension) float32 or float16, rows sorted by student id
+    ids     (count) int32 student id of every row
+
+The file is always replaced atomically, mapped readers keep the previous copy until they open it again.
+"""
+import os
+import pickle
+import struct
+from typing import Sequence
+
+import numpy as np
+
+from src.settings import DLIB_MODEL, ENCODINGS_FILE, ENCODINGS_DTYPE, LEGACY_ENCODINGS_FILE
+
+MAGIC = b"FENC"
+VERSION = 1
+HEADER_SIZE = 64
+# magic, version, dtype code, dimension, count, model name
+HEADER_FORMAT = "<4sHBxIQ16s"
+DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f2")}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+ID_DTYPE = np.dtype("<i4")
+# dlib's face recognition model produces 128-d embeddings
+ENCODING_DIM = 128
+
+
+class EncodingsStore:
+    """Known face encodings and the student id of every encoding, see the module docstring for the layout"""
+    def __init__(self, encodings: np.ndarray, ids: np.ndarray, model: str = DLIB_MODEL, path: str = None):
+        self.encodings = encodings
+        self.ids = ids
+        self.model = model
+        self.path = path
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls, dim: int = ENCODING_DIM) -> "EncodingsStore":
+        return cls(np.empty((0, dim), dtype=np.float32), np.empty(0, dtype=ID_DTYPE))
+
+    @classmethod
+    def open(cls, path: str = ENCODINGS_FILE) -> "EncodingsStore":
+        """Map the store read-only, the pages are shared with every other process mapping the same file"""
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError(f"'{path}' is not an encodings store")
+        magic, version, dtype_code, dim, count, model = struct.unpack_from(HEADER_FORMAT, header)
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not an encodings store")
+        if version != VERSION:
+            raise ValueError(f"Unsupported encodings store version {version} in '{path}'")
+
+        dtype = DTYPES[dtype_code]
+        model = model.rstrip(b"\0").decode("ascii")
+        if count == 0:
+            store = cls.empty(dim)
+            store.model, store.path = model, path
+            return store
+        encodings = np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count, dim))
+        ids = np.memmap(path, dtype=ID_DTYPE, mode="r", offset=HEADER_SIZE + count * dim * dtype.itemsize,
+                        shape=(count,))
+        return cls(encodings, ids, model, path)
+
+    @classmethod
+    def load(cls, path: str = ENCODINGS_FILE, legacy_path: str = LEGACY_ENCODINGS_FILE) -> "EncodingsStore":
+        """
+        Open the store, migrating the legacy pickle the first time it is needed.
+        Returns an empty store when nothing was trained yet.
+        """
+        if not os.path.exists(path):
+            if legacy_path and os.path.exists(legacy_path):
+                cls.migrate(legacy_path, path)
+            else:
+                return cls.empty()
+        return cls.open(path)
+
+    @classmethod
+    def write(cls, encodings: Sequence[np.ndarray], ids: Sequence[int], path: str = ENCODINGS_FILE,
+              model: str = DLIB_MODEL, dtype: str = ENCODINGS_DTYPE) -> "EncodingsStore":
+        """Write a new version of the store and atomically replace the old one"""
+        dtype = np.dtype(dtype).newbyteorder("<")
+        ids = np.asarray(ids, dtype=ID_DTYPE).reshape(-1)
+        encodings = np.asarray(encodings, dtype=dtype).reshape(len(ids), -1) if len(ids) else \
+            np.empty((0, ENCODING_DIM), dtype=dtype)
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, DTYPE_CODES[dtype], encodings.shape[1], len(ids),
+                             model.encode("ascii")[:16])
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            f.write(np.ascontiguousarray(encodings).tobytes())
+            f.write(ids.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # readers that mapped the previous file keep their pages, new readers see the new file
+        os.replace(tmp_path, path)
+        return cls.open(path)
+
+    @classmethod
+    def migrate(cls, legacy_path: str = LEGACY_ENCODINGS_FILE, path: str = ENCODINGS_FILE) -> "EncodingsStore":
+        """One-shot conversion of the pickled {"encodings": [...], "ids": [...]} dict to the binary store"""
+        print(f"[INFO] migrating encodings from {legacy_path} to {path}...")
+        with open(legacy_path, "rb") as ef:
+            data = pickle.loads(ef.read())
+        encodings = np.asarray(data["encodings"], dtype=np.float32).reshape(len(data["ids"]), -1)
+        ids = np.asarray(data["ids"], dtype=ID_DTYPE)
+        order = np.argsort(ids, kind="stable")
+        return cls.write(encodings[order], ids[order], path)
@@ -0,0 +1,40 @@
+from typing import List, Tuple
+
+import numpy as np
+import face_recognition
+
+from src.libs.detectors import Box, get_detector
+
+# Tasks of the recognition workers and the recognition service. Spawned workers import this module to
+# unpickle them, so it must stay free of the database, Flask and the attendance machinery.
+
+
+def detect_faces(rgb: np.ndarray, name: str, upsample: int) -> List[Box]:
+    """Boxes found by detector `name`, every worker process loads each detector once"""
+    return get_detector(name, upsample)(rgb)
+
+
+def encode_faces(rgb: np.ndarray, boxes: List[Box]) -> List[np.ndarray]:
+    """128-d dlib encoding of every detected face"""
+    return face_recognition.face_encodings(rgb, boxes)
+
+
+def crop_faces(rgb: np.ndarray, boxes: List[Box], margin: float = 0.5) -> List[Tuple[np.ndarray, Box]]:
+    """
+    Crop every face with a margin of context (dlib needs some of it to place the landmarks),
+    with its box in the coordinates of the crop. Crops are what is sent to other processes.
+    """
+    height, width = rgb.shape[:2]
+    crops = []
+    for top, right, bottom, left in boxes:
+        margin_y = int((bottom - top) * margin)
+        margin_x = int((right - left) * margin)
+        y0, y1 = max(top - margin_y, 0), min(bottom + margin_y, height)
+        x0, x1 = max(left - margin_x, 0), min(right + margin_x, width)
+        crops.append((np.ascontiguousarray(rgb[y0:y1, x0:x1]), (top - y0, right - x0, bottom - y0, left - x0)))
+    return crops
+
+
+def encode_crops(crops: List[Tuple[np.ndarray, Box]]) -> List[np.ndarray]:
+    """Encoding of the face of every crop"""
+    return [face_recognition.face_encodings(crop, [box])[0] for crop, box in crops]
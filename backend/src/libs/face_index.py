@@ -0,0 +1,280 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, Tuple
+
+import numpy as np
+
+from src.settings import (
+    FACE_INDEX, FACE_INDEX_FILE,
+    KDTREE_EPS, IVF_LISTS, IVF_NPROBE,
+    QUANTIZATION, QUANTIZED_CANDIDATES
+)
+
+
+def squared_distances(probes: np.ndarray, encodings: np.ndarray, norms: np.ndarray = None) -> np.ndarray:
+    """Squared euclidean distance of every probe (rows) to every encoding (columns) as one matrix product"""
+    if norms is None:
+        norms = np.einsum("ij,ij->i", encodings, encodings)
+    squared = probes @ encodings.T
+    squared *= -2
+    squared += np.einsum("ij,ij->i", probes, probes)[:, None]
+    squared += norms[None, :]
+    # rounding may push distances of identical vectors slightly below zero
+    return np.maximum(squared, 0, out=squared)
+
+
+def nearest_centroid(data: np.ndarray, centroids: np.ndarray, chunk: int = 16384) -> np.ndarray:
+    """Label of the closest centroid of every row, computed in chunks to bound the distance matrix size"""
+    labels = np.empty(len(data), dtype=np.int64)
+    norms = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(data), chunk):
+        labels[start:start + chunk] = squared_distances(data[start:start + chunk], centroids, norms).argmin(axis=1)
+    return labels
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 20, sample: int = None,
+           seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Plain Lloyd's k-means, returns the (k, dim) centroids and the centroid label of every row.
+    When `sample` is given the centroids are trained on that many random rows only.
+    """
+    k = max(1, min(k, len(data)))
+    rng = np.random.default_rng(seed)
+    train = data
+    if sample and sample < len(data):
+        train = data[rng.choice(len(data), size=max(sample, k), replace=False)]
+    train = np.asarray(train, dtype=np.float32)
+    centroids = train[rng.choice(len(train), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroid(train, centroids)
+        # mean of the members of every centroid, empty centroids keep their position
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        moved = sums[filled] / counts[filled, None]
+        if np.allclose(moved, centroids[filled]):
+            break
+        centroids[filled] = moved
+    return centroids, nearest_centroid(data, centroids)
+
+
+def _top_k(distances: np.ndarray, indices: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep the k smallest distances of every row sorted ascending, padded with inf / -1"""
+    if distances.shape[1] < k:
+        pad = k - distances.shape[1]
+        distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+        indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+    if distances.shape[1] > k:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, part, axis=1)
+        indices = np.take_along_axis(indices, part, axis=1)
+    order = np.argsort(distances, axis=1, kind="stable")
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class FaceIndex(ABC):
+    """
+    Base class of the gallery indexes. An index answers k nearest neighbour queries over the rows of
+    the gallery matrix it was built on, `search` returns euclidean distances and row indices.
+    """
+    kind = None
+
+    def __init__(self, encodings: np.ndarray):
+        self.encodings = encodings
+
+    @abstractmethod
+    def search(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(distances, row indices) of the k nearest rows of every probe, nearest first"""
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to restore the index without building it again"""
+        return {}
+
+    @classmethod
+    def from_state(cls, encodings: np.ndarray, state: Dict[str, np.ndarray]) -> "FaceIndex":
+        return cls(encodings)
+
+    def save(self, path: str = FACE_INDEX_FILE) -> None:
+        np.savez(path, kind=self.kind, count=len(self.encodings), **self.state())
+
+
+class BruteForceIndex(FaceIndex):
+    """Exact linear scan over the whole gallery"""
+    kind = "brute"
+
+    def __init__(self, encodings: np.ndarray):
+        super().__init__(encodings)
+        self.norms = np.einsum("ij,ij->i", encodings, encodings)
+
+    def search(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        squared = squared_distances(probes, self.encodings, self.norms)
+        indices = np.broadcast_to(np.arange(len(self.encodings)), squared.shape)
+        distances, indices = _top_k(squared, indices, k)
+        return np.sqrt(distances), indices
+
+
+class KDTreeIndex(FaceIndex):
+    """
+    KD tree over the gallery, exact when `KDTREE_EPS` is 0 and approximate (faster) with a larger eps.
+    The tree is cheap to build and its pickled form embeds a copy of the gallery, so it is rebuilt on load.
+    """
+    kind = "kdtree"
+
+    def __init__(self, encodings: np.ndarray, eps: float = KDTREE_EPS):
+        from scipy.spatial import cKDTree
+
+        super().__init__(encodings)
+        self.eps = eps
+        self.tree = cKDTree(encodings, copy_data=False)
+
+    def search(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self.encodings))
+        distances, indices = self.tree.query(probes, k=k, eps=self.eps)
+        distances = np.asarray(distances, dtype=np.float32).reshape(len(probes), k)
+        indices = np.asarray(indices, dtype=np.int64).reshape(len(probes), k)
+        # cKDTree marks missing neighbours with index n
+        indices[indices == len(self.encodings)] = -1
+        return distances, indices
+
+
+class IVFIndex(FaceIndex):
+    """
+    Inverted file index: k-means splits the gallery into coarse lists and a query only
+    scans the `nprobe` lists whose centroids are closest to the probe.
+    """
+    kind = "ivf"
+
+    def __init__(self, encodings: np.ndarray, nlist: int = IVF_LISTS, nprobe: int = IVF_NPROBE,
+                 centroids: np.ndarray = None, labels: np.ndarray = None):
+        super().__init__(encodings)
+        self.nprobe = nprobe
+        self.norms = np.einsum("ij,ij->i", encodings, encodings)
+        if centroids is None:
+            # default to sqrt(n) lists which balances centroid and list scan costs
+            nlist = nlist or int(np.sqrt(len(encodings)))
+            centroids, labels = kmeans(encodings, nlist, sample=64 * nlist)
+        self.centroids = centroids.astype(np.float32)
+        self.labels = labels.astype(np.int64)
+        # rows of every list are stored contiguously: list i is order[offsets[i]:offsets[i + 1]]
+        self.order = np.argsort(self.labels, kind="stable")
+        self.offsets = np.searchsorted(self.labels[self.order], np.arange(len(self.centroids) + 1))
+
+    def search(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        nprobe = min(self.nprobe, len(self.centroids))
+        closest_lists = np.argsort(squared_distances(probes, self.centroids), axis=1)[:, :nprobe]
+        all_distances = []
+        all_indices = []
+        for probe, lists in zip(probes, closest_lists):
+            candidates = np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+            squared = squared_distances(probe[None, :], self.encodings[candidates], self.norms[candidates])
+            distances, indices = _top_k(squared, candidates[None, :], k)
+            all_distances.append(distances)
+            all_indices.append(indices)
+        return np.sqrt(np.vstack(all_distances)), np.vstack(all_indices)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "labels": self.labels}
+
+    @classmethod
+    def from_state(cls, encodings: np.ndarray, state: Dict[str, np.ndarray]) -> "FaceIndex":
+        return cls(encodings, centroids=state["centroids"], labels=state["labels"])
+
+
+class QuantizedIndex(FaceIndex):
+    """
+    Reduced precision copy of the gallery (float16, or int8 with a per-dimension scale) kept in RAM.
+    A query scans the quantized matrix in cache sized chunks for the `QUANTIZED_CANDIDATES` closest rows,
+    then ranks those again in float32 against the full precision gallery, which stays memory mapped
+    and is only read for the candidate rows.
+    """
+    kind = "quantized"
+    chunk = 4096
+
+    def __init__(self, encodings: np.ndarray, precision: str = QUANTIZATION,
+                 codes: np.ndarray = None, scale: np.ndarray = None):
+        if precision not in ("float16", "int8"):
+            raise ValueError(f"Unknown quantization '{precision}', expected float16 or int8")
+        super().__init__(encodings)
+        self.precision = precision
+        if codes is None:
+            codes, scale = self.quantize(encodings, precision)
+        self.codes = codes
+        self.scale = scale
+        # norms of the dequantized rows, the coarse distance is then one product per chunk
+        self.code_norms = np.concatenate(
+            [np.einsum("ij,ij->i", rows, rows) for rows in self._dequantized_chunks()] + [np.empty(0, np.float32)]
+        )
+
+    @staticmethod
+    def quantize(encodings: np.ndarray, precision: str):
+        encodings = np.asarray(encodings, dtype=np.float32)
+        if precision == "float16":
+            return encodings.astype(np.float16), np.ones(encodings.shape[1], dtype=np.float32)
+        # symmetric per-dimension scale so every dimension uses the full int8 range
+        scale = np.abs(encodings).max(axis=0, initial=0) / 127
+        scale[scale == 0] = 1
+        codes = np.clip(np.rint(encodings / scale), -127, 127).astype(np.int8)
+        return codes, scale.astype(np.float32)
+
+    def _dequantized_chunks(self):
+        for start in range(0, len(self.codes), self.chunk):
+            yield self.codes[start:start + self.chunk].astype(np.float32) * self.scale
+
+    def search(self, probes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        candidates = max(k, QUANTIZED_CANDIDATES)
+        probe_norms = np.einsum("ij,ij->i", probes, probes)[:, None]
+        coarse_distances = []
+        coarse_indices = []
+        for chunk_index, rows in enumerate(self._dequantized_chunks()):
+            start = chunk_index * self.chunk
+            squared = probes @ rows.T
+            squared *= -2
+            squared += probe_norms
+            squared += self.code_norms[None, start:start + len(rows)]
+            indices = np.broadcast_to(np.arange(start, start + len(rows)), squared.shape)
+            # keep the running best candidates only, so memory does not grow with the gallery
+            distances, indices = _top_k(squared, indices, candidates)
+            coarse_distances.append(distances)
+            coarse_indices.append(indices)
+        _, indices = _top_k(np.hstack(coarse_distances), np.hstack(coarse_indices), candidates)
+
+        # exact float32 re-rank of the candidates
+        valid = indices >= 0
+        rows = np.asarray(self.encodings[np.where(valid, indices, 0).ravel()], dtype=np.float32)
+        exact = probes[:, None, :] - rows.reshape(len(probes), candidates, -1)
+        exact = np.einsum("pcd,pcd->pc", exact, exact)
+        exact[~valid] = np.inf
+        distances, indices = _top_k(exact, indices, k)
+        return np.sqrt(distances), indices
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codes": self.codes, "scale": self.scale, "precision": self.precision}
+
+    @classmethod
+    def from_state(cls, encodings: np.ndarray, state: Dict[str, np.ndarray]) -> "FaceIndex":
+        # an index saved with another precision is built again
+        if str(state["precision"]) != QUANTIZATION:
+            return cls(encodings)
+        return cls(encodings, codes=state["codes"], scale=state["scale"])
+
+
+INDEX_TYPES = {
+    index_type.kind: index_type for index_type in (BruteForceIndex, KDTreeIndex, IVFIndex, QuantizedIndex)
+}
+
+
+def build_index(encodings: np.ndarray, kind: str = FACE_INDEX) -> FaceIndex:
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown face index '{kind}', expected one of {', '.join(INDEX_TYPES)}")
+    return INDEX_TYPES[kind](encodings)
+
+
+def load_index(encodings: np.ndarray, kind: str = FACE_INDEX, path: str = FACE_INDEX_FILE) -> FaceIndex:
+    """Restore the index saved by `TrainClassifier.train`, build it again if it is missing or stale"""
+    if os.path.exists(path):
+        saved = np.load(path)
+        if str(saved["kind"]) == kind and int(saved["count"]) == len(encodings):
+            state = {name: saved[name] for name in saved.files if name not in ("kind", "count")}
+            return INDEX_TYPES[kind].from_state(encodings, state)
+    return build_index(encodings, kind)
@@ -0,0 +1,247 @@
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from src.settings import (
+    DLIB_TOLERANCE, ENCODINGS_FILE, MATCH_STRATEGY,
+    FACE_INDEX, FACE_INDEX_FILE, FACE_INDEX_K,
+    PROTOTYPES_FILE, PROTOTYPES_PER_STUDENT, PROTOTYPE_RERANK_MARGIN
+)
+from src.libs.encodings_store import EncodingsStore, ENCODING_DIM
+from src.libs.face_index import (
+    INDEX_TYPES, FaceIndex, BruteForceIndex, build_index, load_index, squared_distances
+)
+
+
+def sort_by_id(encodings: np.ndarray, ids: np.ndarray):
+    """Order the gallery by student id, the order `FaceMatcher` and the saved indexes rely on"""
+    order = np.argsort(ids, kind="stable")
+    return encodings[order], ids[order]
+
+
+class FaceMatcher:
+    """
+    Holds the known gallery as one contiguous float32 matrix and matches every face of a frame against it
+    in a single vectorized pass instead of one `face_recognition.compare_faces` call per face.
+    """
+
+    def __init__(self, encodings: Sequence[np.ndarray], ids: Sequence[int],
+                 tolerance: float = DLIB_TOLERANCE, strategy: str = MATCH_STRATEGY,
+                 index: Union[FaceIndex, str] = None, k: int = FACE_INDEX_K):
+        if strategy not in ("vote", "nearest"):
+            raise ValueError(f"Unknown match strategy '{strategy}'")
+        self.tolerance = tolerance
+        self.strategy = strategy
+        self.k = k
+
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        # the samples of one student must be contiguous so the votes of a student can be summed
+        # with a single reduceat, galleries saved by `TrainClassifier` are already sorted
+        if np.any(ids[1:] < ids[:-1]):
+            encodings, ids = sort_by_id(encodings, ids)
+        self.encodings = np.ascontiguousarray(encodings)
+        self.ids = ids
+        self._norms = None
+        self.unique_ids, self.starts = np.unique(self.ids, return_index=True)
+
+        # an exact linear scan is done right here, other indexes only return the k nearest candidates
+        if isinstance(index, str) and len(self.ids):
+            index = build_index(self.encodings, index)
+        self.index = None if isinstance(index, (str, BruteForceIndex)) else index
+        # optional compacted gallery (a few prototypes per student) scanned before the full samples
+        self.prototypes = None
+        self.rerank_margin = PROTOTYPE_RERANK_MARGIN
+
+    @classmethod
+    def from_file(cls, path: str = ENCODINGS_FILE, index: str = FACE_INDEX,
+                  index_path: str = FACE_INDEX_FILE, **kwargs) -> "FaceMatcher":
+        """Load the gallery and the index stored by `TrainClassifier.train`"""
+        store = EncodingsStore.load(path)
+        # a float32 store is used in place, its pages are shared by every process mapping it
+        matcher = cls(store.encodings, store.ids, **kwargs)
+        if index != BruteForceIndex.kind and len(matcher):
+            matcher.index = load_index(matcher.encodings, index, index_path)
+        if PROTOTYPES_PER_STUDENT and len(matcher):
+            prototypes = EncodingsStore.load(PROTOTYPES_FILE, legacy_path=None)
+            # prototypes of another version of the gallery are ignored until the next training
+            if np.array_equal(np.unique(prototypes.ids), matcher.unique_ids):
+                matcher.use_prototypes(prototypes.encodings, prototypes.ids)
+        return matcher
+
+    def use_prototypes(self, encodings: Sequence[np.ndarray], ids: Sequence[int]):
+        """Scan these per-student prototypes first and fall back to the full samples near the tolerance"""
+        self.prototypes = FaceMatcher(encodings, ids, self.tolerance, strategy="nearest")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def norms(self) -> np.ndarray:
+        """
+        Squared norms of the gallery, computed once so the distance of a probe costs one matrix product.
+        Computed on first use, a matcher searching through an index never reads the whole mapped gallery.
+        """
+        if self._norms is None:
+            self._norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+        return self._norms
+
+    def distances(self, probes: np.ndarray) -> np.ndarray:
+        """Euclidean distance of every probe (rows) to every gallery encoding (columns)"""
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        squared = squared_distances(probes, self.encodings, self.norms)
+        return np.sqrt(squared, out=squared)
+
+    def match(self, probes: Sequence[np.ndarray]) -> List[Optional[int]]:
+        """
+        Return the matched student id of each probe encoding, or None when the face is unknown.
+        With the "vote" strategy the student with most gallery samples within tolerance wins
+        (ties go to the lower id), with "nearest" the closest sample within tolerance wins.
+        """
+        if len(probes) == 0:
+            return []
+        if len(self) == 0:
+            return [None] * len(probes)
+        if self.prototypes is not None:
+            return self._match_prototypes(probes)
+        if self.index is not None:
+            return self._match_candidates(probes)
+
+        distances = self.distances(probes)
+        rows = np.arange(len(distances))
+        if self.strategy == "nearest":
+            nearest = distances.argmin(axis=1)
+            matched = distances[rows, nearest] <= self.tolerance
+            best_ids = self.ids[nearest]
+        else:
+            within = distances <= self.tolerance
+            # count the matched samples of every student: one segment per student in the sorted gallery
+            votes = np.add.reduceat(within.view(np.uint8), self.starts, axis=1, dtype=np.int32)
+            best = votes.argmax(axis=1)
+            matched = votes[rows, best] > 0
+            best_ids = self.unique_ids[best]
+
+        return [int(_id) if ok else None for _id, ok in zip(best_ids, matched)]
+
+    def _match_candidates(self, probes: Sequence[np.ndarray]) -> List[Optional[int]]:
+        """
+        Same semantics as `match`, ties included, but only over the k nearest samples returned by the index,
+        so a student with more than k samples within tolerance gets at most k votes
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        distances, indices = self.index.search(probes, self.k)
+        within = (distances <= self.tolerance) & (indices >= 0)
+        candidate_ids = np.where(within, self.ids[indices], -1)
+        if self.strategy == "nearest":
+            # candidates come sorted by distance, so the first one within tolerance is the nearest
+            best_ids = candidate_ids[:, 0]
+        else:
+            # votes[p, j]: how many candidates of probe p share the id of candidate j
+            same = candidate_ids[:, :, None] == candidate_ids[:, None, :]
+            votes = (same & within[:, None, :]).sum(axis=2)
+            votes[~within] = 0
+            # on a tie the lower id wins like the full scan, not the nearest candidate
+            top = within & (votes == votes.max(axis=1, keepdims=True))
+            best_ids = np.where(top, candidate_ids, np.iinfo(np.int64).max).min(axis=1)
+            best_ids[~within.any(axis=1)] = -1
+        return [int(_id) if _id >= 0 else None for _id in best_ids]
+
+    def _match_prototypes(self, probes: Sequence[np.ndarray]) -> List[Optional[int]]:
+        """
+        Decide clear matches and clear unknowns on the prototypes alone. Probes whose closest prototype
+        is within `rerank_margin` of the tolerance are matched again on the full samples of the students
+        whose prototypes came that close.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        prototypes = self.prototypes
+        # closest prototype distance of every student, one segment per student like the votes
+        student_distances = np.minimum.reduceat(prototypes.distances(probes), prototypes.starts, axis=1)
+        best = student_distances.argmin(axis=1)
+        best_distances = student_distances[np.arange(len(probes)), best]
+
+        results = []
+        for probe, distances, student, distance in zip(probes, student_distances, best, best_distances):
+            if distance <= self.tolerance - self.rerank_margin:
+                results.append(int(prototypes.unique_ids[student]))
+            elif distance > self.tolerance + self.rerank_margin:
+                results.append(None)
+            else:
+                candidates = prototypes.unique_ids[distances <= self.tolerance + self.rerank_margin]
+                results.append(self._rerank(probe, candidates))
+        return results
+
+    def _rerank(self, probe: np.ndarray, candidate_ids: np.ndarray) -> Optional[int]:
+        """Match one probe against the full samples of the candidate students only"""
+        positions = np.searchsorted(self.unique_ids, candidate_ids)
+        ends = np.append(self.starts[1:], len(self.ids))
+        rows = np.concatenate([np.arange(self.starts[i], ends[i]) for i in positions])
+        squared = squared_distances(probe[None, :], self.encodings[rows], self.norms[rows])[0]
+        within = np.sqrt(squared) <= self.tolerance
+        if not within.any():
+            return None
+        if self.strategy == "nearest":
+            return int(self.ids[rows[np.argmin(squared)]])
+        # rows are sorted by id, so on a tie the lower id wins like the full scan
+        matched_ids, votes = np.unique(self.ids[rows][within], return_counts=True)
+        return int(matched_ids[votes.argmax()])
+
+
+def prototype_report(matcher: FaceMatcher, prototypes: np.ndarray, prototype_ids: np.ndarray,
+                     probes: np.ndarray) -> Dict:
+    """Shrink factor, agreement with the uncompressed gallery and latency of prototype matching"""
+    full = FaceMatcher(matcher.encodings, matcher.ids, matcher.tolerance, matcher.strategy)
+    compact = FaceMatcher(matcher.encodings, matcher.ids, matcher.tolerance, matcher.strategy)
+    compact.use_prototypes(prototypes, prototype_ids)
+
+    start = time.perf_counter()
+    expected = full.match(probes)
+    full_time = time.perf_counter() - start
+    start = time.perf_counter()
+    results = compact.match(probes)
+    compact_time = time.perf_counter() - start
+
+    best = np.minimum.reduceat(compact.prototypes.distances(probes), compact.prototypes.starts, axis=1).min(axis=1)
+    reranked = np.abs(best - matcher.tolerance) <= compact.rerank_margin
+    return {
+        "shrink_factor": len(matcher) / len(prototype_ids),
+        "agreement": float(np.mean([a == b for a, b in zip(expected, results)])),
+        "reranked": float(reranked.mean()),
+        "full_ms": 1000 * full_time / len(probes),
+        "prototype_ms": 1000 * compact_time / len(probes),
+    }
+
+
+def index_report(encodings: np.ndarray, ids: np.ndarray, probes: np.ndarray, tolerance: float,
+                 k: int) -> Dict[str, Dict]:
+    """
+    Compare every index type against the exact brute force scan on the given probes:
+    recall is the fraction of the true k nearest neighbours within tolerance that the index returns,
+    agreement the fraction of probes matched to the same student (or to none) as the exact scan.
+    """
+    encodings, ids = sort_by_id(np.asarray(encodings, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+    probes = np.asarray(probes, dtype=np.float32)
+    exact_distances, exact_indices = BruteForceIndex(encodings).search(probes, k)
+    expected = [set(row[dist <= tolerance]) for row, dist in zip(exact_indices, exact_distances)]
+    expected_ids = FaceMatcher(encodings, ids, tolerance, index=BruteForceIndex.kind).match(probes)
+
+    report = {}
+    for kind in INDEX_TYPES:
+        start = time.perf_counter()
+        index = build_index(encodings, kind)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        distances, indices = index.search(probes, k)
+        query_time = time.perf_counter() - start
+
+        found = sum(len(truth & set(row[dist <= tolerance])) for truth, row, dist in zip(expected, indices, distances))
+        total = sum(len(truth) for truth in expected)
+        matched_ids = FaceMatcher(encodings, ids, tolerance, index=index, k=k).match(probes)
+        report[kind] = {
+            "build_s": build_time,
+            "query_ms": 1000 * query_time / max(len(probes), 1),
+            "recall": found / total if total else 1.0,
+            "agreement": float(np.mean([a == b for a, b in zip(expected_ids, matched_ids)])) if len(probes) else 1.0,
+        }
+    return report
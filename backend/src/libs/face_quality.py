@@ -0,0 +1,95 @@
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import face_recognition
+
+from src.settings import (
+    FACE_QUALITY_GATE, FACE_MIN_SIZE, FACE_MIN_SHARPNESS, FACE_MIN_BRIGHTNESS, FACE_MAX_BRIGHTNESS, FACE_MAX_YAW
+)
+from src.libs.detectors import Box
+
+REJECT_REASONS = ("too_small", "blurry", "too_dark", "too_bright", "turned")
+
+
+class FaceQualityGate:
+    """
+    Rejects detected faces that are not worth encoding: too small, blurred (low variance of the
+    Laplacian), too dark or too bright, or turned away (nose far from the middle of the eyes).
+    Such faces rarely match and make false matches when they end up in the gallery.
+    Counters are kept per pipeline `name` for the whole process.
+    """
+    counters = {}  # pipeline name -> Counter of "passed" and reject reasons
+    lock = threading.Lock()
+
+    def __init__(self, name: str, min_size: int = FACE_MIN_SIZE, min_sharpness: float = FACE_MIN_SHARPNESS,
+                 min_brightness: int = FACE_MIN_BRIGHTNESS, max_brightness: int = FACE_MAX_BRIGHTNESS,
+                 max_yaw: float = FACE_MAX_YAW):
+        self.name = name
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_yaw = max_yaw
+        with self.lock:
+            self.counters.setdefault(name, Counter())
+
+    def reject_reason(self, rgb: np.ndarray, box: Box) -> Optional[str]:
+        """Why the face should not be encoded, None if it is good enough"""
+        top, right, bottom, left = box
+        if min(bottom - top, right - left) < self.min_size:
+            return "too_small"
+
+        crop = rgb[max(top, 0):bottom, max(left, 0):right]
+        if not crop.size:
+            return "too_small"
+        # measured on a fixed size so the scores do not depend on the face size
+        gray = cv2.resize(cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY), (96, 96), interpolation=cv2.INTER_AREA)
+        brightness = gray.mean()
+        if brightness < self.min_brightness:
+            return "too_dark"
+        if brightness > self.max_brightness:
+            return "too_bright"
+        if cv2.Laplacian(gray, cv2.CV_64F).var() < self.min_sharpness:
+            return "blurry"
+
+        if self.max_yaw:
+            landmarks = face_recognition.face_landmarks(rgb, [box], model="small")
+            if landmarks:
+                left_eye = np.mean(landmarks[0]["left_eye"], axis=0)
+                right_eye = np.mean(landmarks[0]["right_eye"], axis=0)
+                nose = np.mean(landmarks[0]["nose_tip"], axis=0)
+                eye_distance = np.linalg.norm(right_eye - left_eye)
+                if eye_distance and abs(nose[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance > self.max_yaw:
+                    return "turned"
+        return None
+
+    def filter(self, rgb: np.ndarray, boxes: List[Box]) -> List[bool]:
+        """Whether each face passes the gate, counting the reasons of the rejected ones"""
+        reasons = [self.reject_reason(rgb, box) for box in boxes]
+        self.count(reasons)
+        return [reason is None for reason in reasons]
+
+    def count(self, reasons: List[Optional[str]]):
+        with self.lock:
+            self.counters[self.name].update(reason or "passed" for reason in reasons)
+
+    @staticmethod
+    def signature() -> Optional[Dict[str, float]]:
+        """Configured thresholds (None when the gate is off), recorded with the gallery they built"""
+        if not FACE_QUALITY_GATE:
+            return None
+        return {
+            "min_size": FACE_MIN_SIZE,
+            "min_sharpness": FACE_MIN_SHARPNESS,
+            "min_brightness": FACE_MIN_BRIGHTNESS,
+            "max_brightness": FACE_MAX_BRIGHTNESS,
+            "max_yaw": FACE_MAX_YAW,
+        }
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, int]]:
+        with cls.lock:
+            return {name: dict(counter) for name, counter in cls.counters.items()}
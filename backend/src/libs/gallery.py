@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+import traceback
+from typing import Optional, Tuple
+
+from src.settings import ENCODINGS_FILE, GALLERY_POLL_SECONDS
+from src.libs.face_matcher import FaceMatcher
+
+
+class Gallery:
+    """
+    Process-wide holder of the live `FaceMatcher` snapshot.
+
+    Recognizers call `Gallery.current()` once per frame and use that snapshot for the whole frame.
+    A new snapshot is swapped in with a single reference assignment, so readers never take a lock;
+    the previous snapshot is freed once the last frame using it is done. Snapshots published by
+    another process (e.g. the training queue of the REST app) are picked up by polling the store's stat.
+    """
+    matcher = None
+    version = 0
+    stamp = None  # (inode, mtime, size) of the store the current snapshot was loaded from
+    checked_at = 0.0
+    lock = threading.Lock()  # serializes loaders only
+
+    @classmethod
+    def current(cls) -> FaceMatcher:
+        now = time.monotonic()
+        if cls.matcher is None or now - cls.checked_at >= GALLERY_POLL_SECONDS:
+            cls.checked_at = now
+            cls.reload()
+        return cls.matcher
+
+    @classmethod
+    def publish(cls, matcher: FaceMatcher, stamp: Tuple = None) -> int:
+        """Make `matcher` the snapshot every recognizer uses from its next frame on"""
+        cls.stamp = stamp
+        cls.matcher = matcher
+        cls.version += 1
+        print(f"[INFO] gallery version {cls.version} published ({len(matcher)} encodings)")
+        return cls.version
+
+    @classmethod
+    def reload(cls, force: bool = False) -> Optional[int]:
+        """
+        Load the store again if it changed since the current snapshot, returns the new version.
+        Without `force` a reload already running in another thread is not waited for.
+        """
+        if not cls.lock.acquire(blocking=force or cls.matcher is None):
+            return None
+        try:
+            stamp = cls.store_stamp()
+            if cls.matcher is not None and stamp == cls.stamp:
+                return None
+            try:
+                matcher = FaceMatcher.from_file(ENCODINGS_FILE)
+            except Exception:
+                if cls.matcher is None:
+                    raise
+                # keep serving the previous snapshot rather than stopping every feed
+                traceback.print_exc()
+                return None
+            return cls.publish(matcher, stamp)
+        finally:
+            cls.lock.release()
+
+    @staticmethod
+    def store_stamp() -> Optional[Tuple]:
+        try:
+            stat = os.stat(ENCODINGS_FILE)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,63 @@
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from src.settings import MOTION_WIDTH, MOTION_THRESHOLD, MOTION_MIN_AREA, MOTION_REFRESH_SECONDS
+from src.libs.roi import RegionOfInterest
+
+
+class MotionGate:
+    """
+    Cheap change detector run before face detection. A frame is compared, downsampled to `width`
+    and blurred, with the last frame that was let through; when less than `min_area` of the pixels
+    changed by more than `threshold` gray levels the frame is static and detection is skipped.
+    A frame is let through anyway every `refresh_seconds`.
+    With a region of interest only its pixels are compared, so motion outside it (a corridor, a screen)
+    does not trigger detection, and `min_area` is a share of the region.
+    """
+
+    def __init__(self, width: int = MOTION_WIDTH, threshold: int = MOTION_THRESHOLD,
+                 min_area: float = MOTION_MIN_AREA, refresh_seconds: float = MOTION_REFRESH_SECONDS):
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.refresh_seconds = refresh_seconds
+        self.reference = None
+        self.refreshed_at = 0.0
+        self.region = None  # (roi, frame shape) the reference and mask were computed for
+        self.mask = None  # downsampled mask of the region, None for the whole frame
+
+    def changed(self, frame: np.ndarray, roi: Optional[RegionOfInterest] = None) -> bool:
+        region = (roi, frame.shape[:2])
+        if roi is not None:
+            top, right, bottom, left = roi.bounding_box(frame.shape)
+            frame = frame[top:bottom, left:right]
+        height = max(int(frame.shape[0] * self.width / frame.shape[1]), 1)
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        # blur away sensor noise and compression artifacts
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        if region != self.region:
+            # a new region or resolution, the reference of the previous one is not comparable
+            self.region = region
+            self.reference = None
+            self.mask = None
+            if roi is not None:
+                mask = roi.mask(region[1])[top:bottom, left:right]
+                self.mask = cv2.resize(mask, (self.width, height), interpolation=cv2.INTER_NEAREST) > 0
+
+        now = time.monotonic()
+        if self.reference is None or now - self.refreshed_at >= self.refresh_seconds:
+            changed = True
+        else:
+            moved = cv2.absdiff(gray, self.reference) > self.threshold
+            if self.mask is None:
+                changed = np.count_nonzero(moved) >= self.min_area * gray.size
+            else:
+                changed = np.count_nonzero(moved & self.mask) >= self.min_area * max(np.count_nonzero(self.mask), 1)
+        if changed:
+            self.reference = gray
+            self.refreshed_at = now
+        return changed
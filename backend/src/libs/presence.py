@@ -0,0 +1,111 @@
+import threading
+import traceback
+from datetime import date
+from typing import Optional
+
+from src.db import Session
+from src.settings import PRESENCE_POLL_SECONDS
+from src.libs.gallery import Gallery
+from src.models import StudentModel, AttendanceModel
+
+
+class PresenceCache:
+    """
+    Process-wide cache of the students marked present today and of the name of every student.
+    Recognizers only read it: the database is queried by a background thread, at startup, after
+    a day rollover, after a new gallery version and for ids missing from the directory, so
+    recognizing a student costs no database round trip.
+
+    The name directory is reloaded with every new gallery version: students added or deleted by
+    another process start or stop being matched exactly when their encodings are published.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.day = None
+        self.marked = set()  # ids marked (or claimed for marking) on `day`
+        self.names = {}  # student id -> name, None for ids not in the database until the next reload
+        self.missing = set()  # ids recognized but not in the directory, looked up by the thread
+        self.gallery_version = None  # version of the gallery the directory was loaded for
+
+    def start(self):
+        """Start the thread keeping the cache up to date, if not running"""
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._worker, name="presence-cache", daemon=True)
+                    self.thread.start()
+
+    def refresh(self):
+        """
+        Reload today's presence after a day rollover, the directory after a new gallery version and
+        look up the missing ids. Runs on the cache's thread, or once at startup.
+        """
+        today = date.today()
+        with self.lock:
+            new_day = today != self.day
+            version = Gallery.version
+            new_version = version != self.gallery_version
+            missing, self.missing = self.missing, set()
+
+        marked = AttendanceModel.student_ids_on(today) if new_day else None
+        names = StudentModel.names() if new_version else None
+        found = StudentModel.names(missing) if missing and not new_version else {}
+
+        with self.lock:
+            if new_day:
+                self.marked = marked
+                self.day = today
+                print(f"[INFO] presence of {today}: {len(marked)} students already marked")
+            if new_version:
+                self.names = names
+                self.gallery_version = version
+            for student_id in missing:
+                # deleted ids are remembered as None, not looked up on every frame
+                self.names.setdefault(student_id, found.get(student_id))
+
+    def name(self, student_id: int) -> Optional[str]:
+        """Name of the student, None if deleted or not loaded yet"""
+        try:
+            return self.names[student_id]
+        except KeyError:
+            # added since the directory was loaded, named from the next frame after the lookup
+            with self.lock:
+                self.missing.add(student_id)
+            self.wakeup.set()
+            return None
+
+    def claim(self, student_id: int, today: date) -> bool:
+        """Whether the student is not marked today yet, only the first caller of the day gets True"""
+        with self.lock:
+            if today != self.day:
+                # the presence of the new day is not loaded yet, a duplicate mark is ignored by the writer
+                self.wakeup.set()
+                return True
+            if student_id in self.marked:
+                return False
+            self.marked.add(student_id)
+            return True
+
+    def forget(self, student_id: int):
+        """Drop a deleted student"""
+        with self.lock:
+            self.names[student_id] = None
+            self.marked.discard(student_id)
+
+    def _worker(self):
+        while True:
+            # cleared first, so a request arriving during the refresh is not lost
+            self.wakeup.clear()
+            try:
+                self.refresh()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                Session.remove()
+            self.wakeup.wait(PRESENCE_POLL_SECONDS)
+
+
+presence = PresenceCache()
@@ -0,0 +1,228 @@
+import time
+from datetime import datetime as dtime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import imutils
+import numpy as np
+
+from src.settings import FACE_DETECTOR, FACE_QUALITY_GATE
+from src.libs.attendance_writer import AttendanceWriter
+from src.libs.face_encoding import encode_faces
+from src.libs.face_matcher import FaceMatcher
+from src.libs.face_quality import FaceQualityGate
+from src.libs.gallery import Gallery
+from src.libs.presence import PresenceCache, presence
+from src.libs.roi import RegionOfInterest
+from src.libs.scheduler import FrameScheduler
+from src.libs.detectors import Box, create_detector
+from src.libs.tracker import FaceTracker
+
+
+class RecognizedFace(NamedTuple):
+    box: Box  # in the coordinates of the original frame
+    student_id: Optional[int]
+    name: str
+    track_id: Optional[int] = None
+
+
+# start of frame markers holding the image size (not DHT, JPG and DAC which share the range)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) read from the headers of a JPEG without decoding it, None if not a JPEG"""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:  # markers without payload
+            i += 2
+            continue
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def decode_frame(data: bytes, min_width: int = 0) -> Optional[np.ndarray]:
+    """
+    Decode a JPEG frame, at 1/2, 1/4 or 1/8 of its size when it stays at least `min_width` wide.
+    The reduced decode skips most of the IDCT work, so oversized client frames cost little.
+    """
+    flag = cv2.IMREAD_COLOR
+    size = jpeg_size(data) if min_width else None
+    if size:
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if size[0] // factor >= min_width:
+                flag = reduced
+                break
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+
+
+class AttendanceSink:
+    """
+    Marks the attendance of recognized students once per day and resolves their names.
+    One sink is shared by every recognizer of the process, so a student seen by several feeds is
+    looked up and marked once; students already present are answered from the `presence` cache
+    and new marks are written by the `AttendanceWriter` thread, so recognizers never wait for the database.
+    """
+
+    def __init__(self, cache: PresenceCache = presence):
+        self.presence = cache
+
+    def record(self, student_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """Mark attendance of the students if not marked today, returns their names (None if deleted)"""
+        names = {}
+        now = dtime.now()
+        self.presence.start()
+        for student_id in set(student_ids):
+            names[student_id] = self.presence.name(student_id)
+            if names[student_id] is not None and self.presence.claim(student_id, now.date()):
+                AttendanceWriter.submit(student_id, now)
+        return names
+
+
+attendance_sink = AttendanceSink()
+
+
+class RecognitionEngine:
+    """
+    The detect -> encode -> match -> mark attendance -> annotate pipeline shared by every entry point.
+    Each stage is pluggable: `detector(rgb) -> boxes`, `encoder(rgb, boxes) -> encodings`,
+    `matcher() -> FaceMatcher` returning the snapshot to use and `sink.record(ids) -> names`.
+    An `identifier([(rgb, boxes), ...]) -> ids` replaces the encoder and matcher stages at once,
+    e.g. to have faces identified by the recognition service.
+    """
+
+    def __init__(self, detector: Callable[[np.ndarray], List[Box]] = None,
+                 encoder: Callable[[np.ndarray, List[Box]], List[np.ndarray]] = encode_faces,
+                 matcher: Callable[[], FaceMatcher] = Gallery.current,
+                 sink: AttendanceSink = attendance_sink,
+                 identifier: Callable[[List[Tuple[np.ndarray, List[Box]]]], List[Optional[int]]] = None,
+                 detect_width: int = None, upsample: int = 1, draw_unknown: bool = False,
+                 name: str = "recognition"):
+        self.detector = detector or create_detector(FACE_DETECTOR, upsample)
+        self.encoder = encoder
+        self.matcher = matcher
+        self.identifier = identifier or self.identify
+        self.sink = sink
+        # frames wider than this are resized before detection (to speedup processing),
+        # faces are still encoded on the full resolution frame
+        self.detect_width = detect_width
+        self.draw_unknown = draw_unknown
+        # faces not worth encoding are dropped, counted under the pipeline `name`
+        self.quality = FaceQualityGate(name) if FACE_QUALITY_GATE else None
+        # faces are only looked for in this region of the frames, e.g. a doorway
+        self.roi = None  # type: Optional[RegionOfInterest]
+
+    def process(self, frames: Sequence[np.ndarray], tracker: FaceTracker = None,
+                scale: float = 1.0) -> List[List[RecognizedFace]]:
+        """
+        Recognize the faces of a batch of BGR frames, all faces of the batch are matched at once.
+        With a `tracker` the frames are consecutive frames of its stream and only the faces
+        the tracker asks for are encoded, the others keep the identity of their track.
+        `scale` lowers the detection width further, e.g. for an overloaded stream.
+        """
+        frame_tracks = []
+        encoded_tracks = []
+        faces = []
+        for frame in frames:
+            # convert the input frame from BGR to RGB (dlib ordering)
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # only the bounding box of the region of interest is searched for faces
+            top, right, bottom, left = (0, rgb.shape[1], rgb.shape[0], 0)
+            if self.roi:
+                top, right, bottom, left = self.roi.bounding_box(rgb.shape)
+            region = rgb[top:bottom, left:right]
+            boxes = []
+            if region.size:
+                # the region is resized like the whole frame would be, so faces keep the same size
+                width = int((self.detect_width or rgb.shape[1]) * scale)
+                small = region
+                if width < rgb.shape[1]:
+                    small = imutils.resize(region, width=max(int(region.shape[1] * width / rgb.shape[1]), 1))
+                r = region.shape[1] / float(small.shape[1])
+                # dlib needs contiguous pixels, a cropped view is not
+                small = np.ascontiguousarray(small)
+
+                # detect the (x, y)-coordinates of the bounding boxes
+                # corresponding to each face in the resized region,
+                # then rescale the face coordinates to the original frame
+                for y0, x1, y1, x0 in self.detector(small):
+                    boxes.append((int(y0 * r) + top, int(x1 * r) + left, int(y1 * r) + top, int(x0 * r) + left))
+                if self.roi:
+                    # faces centred outside the region are not looked at
+                    boxes = [box for box in boxes if self.roi.contains(box, rgb.shape)]
+            tracks = (tracker or FaceTracker(optical_flow=False)).update(rgb, boxes)
+
+            # faces that are not tracked already are identified on the full resolution frame,
+            # so downscaled detection costs no accuracy
+            pending = [track for track in tracks if track.encode]
+            if self.quality and pending:
+                passed = self.quality.filter(rgb, [track.box for track in pending])
+                for track, ok in zip(pending, passed):
+                    if not ok:
+                        # looked at again on the next analysed frame
+                        track.since_encoded = None
+                pending = [track for track, ok in zip(pending, passed) if ok]
+            if pending:
+                faces.append((rgb, [track.box for track in pending]))
+                encoded_tracks.extend(pending)
+            frame_tracks.append([(track.box, track) for track in tracks])
+
+        for track, student_id in zip(encoded_tracks, self.identifier(faces) if faces else []):
+            track.student_id = student_id
+        names = self.sink.record(
+            track.student_id for tracks in frame_tracks for _, track in tracks if track.student_id is not None
+        )
+
+        results = []
+        for tracks in frame_tracks:
+            frame_faces = []
+            for box, track in tracks:
+                name = names.get(track.student_id) if track.student_id is not None else None
+                frame_faces.append(RecognizedFace(box, track.student_id if name else None, name or "Unknown", track.id))
+            results.append(frame_faces)
+        return results
+
+    def identify(self, faces: List[Tuple[np.ndarray, List[Box]]]) -> List[Optional[int]]:
+        """Encode the faces of every frame, then match them all against one snapshot of the gallery"""
+        encodings = []
+        for rgb, boxes in faces:
+            # compute the facial embeddings for each face
+            encodings.extend(self.encoder(rgb, boxes))
+        return self.matcher().match(encodings)
+
+    def process_stream(self, frame: np.ndarray, tracker: FaceTracker = None,
+                       scheduler: FrameScheduler = None) -> List[RecognizedFace]:
+        """
+        Recognize the faces of the next frame of a stream when its scheduler picks the frame,
+        otherwise return the faces of the last analysed frame
+        """
+        if scheduler is None:
+            return self.process([frame], tracker)[0]
+        # static frames (see `MotionGate`) keep the faces of the last analysed frame too
+        if scheduler.should_process(frame, self.roi):
+            started = time.perf_counter()
+            scheduler.faces = self.process([frame], tracker, scheduler.scale)[0]
+            scheduler.processed(time.perf_counter() - started)
+        return scheduler.faces
+
+    def annotate(self, frame: np.ndarray, faces: List[RecognizedFace]) -> np.ndarray:
+        """Draw the box and name of the recognized faces on the frame (in place)"""
+        for (top, right, bottom, left), student_id, name, _ in faces:
+            if student_id is None and not self.draw_unknown:
+                continue
+            # draw the predicted face name on the image
+            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+            y = top - 15 if top - 15 > 15 else top + 15
+            cv2.putText(frame, name, (left, y), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
+        return frame
@@ -0,0 +1,147 @@
+import os
+import time
+import queue
+import threading
+import traceback
+from itertools import count
+from multiprocessing.connection import Client, Connection, Listener
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from src.settings import (
+    RECOGNITION_SERVICE_ADDRESS, RECOGNITION_SERVICE_AUTHKEY,
+    RECOGNITION_BATCH_SIZE, RECOGNITION_BATCH_WAIT_MS, RECOGNITION_SERVICE_TIMEOUT
+)
+from src.libs.gallery import Gallery
+from src.libs.detectors import Box
+from src.libs.face_encoding import crop_faces, encode_crops
+
+# seconds before a client that could not reach the service tries again
+RECONNECT_SECONDS = 5.0
+
+
+class RecognitionService:
+    """
+    Identifies face crops sent by every feed and socket client of the machine over a Unix socket.
+    Requests are collected into micro-batches of up to `batch_size` faces, or whatever arrived within
+    `max_wait_ms` of the first one, encoded and matched with a single call against the one gallery
+    and the one set of dlib models the service loads, instead of a copy per feed.
+    """
+
+    def __init__(self, address: str = RECOGNITION_SERVICE_ADDRESS, batch_size: int = RECOGNITION_BATCH_SIZE,
+                 max_wait_ms: float = RECOGNITION_BATCH_WAIT_MS):
+        self.address = address
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()  # (connection, request id, crops)
+
+    def serve_forever(self):
+        print("[INFO] loading encodings...")
+        Gallery.current()
+        # a socket left behind by a previous run would make the bind fail
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, family="AF_UNIX", authkey=RECOGNITION_SERVICE_AUTHKEY.encode())
+        threading.Thread(target=self._batcher, name="batcher", daemon=True).start()
+        print(f"[INFO] recognition service listening on {self.address}")
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception:
+                    # failed handshake, e.g. wrong authkey
+                    traceback.print_exc()
+                    continue
+                threading.Thread(target=self._reader, args=(connection,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def _reader(self, connection: Connection):
+        """Queue the requests of one client until it disconnects"""
+        while True:
+            try:
+                request_id, crops = connection.recv()
+            except (EOFError, OSError):
+                break
+            self.requests.put((connection, request_id, crops))
+        connection.close()
+
+    def _batcher(self):
+        while True:
+            batch = [self.requests.get()]
+            faces = len(batch[0][2])
+            deadline = time.monotonic() + self.max_wait
+            while faces < self.batch_size:
+                try:
+                    item = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                batch.append(item)
+                faces += len(item[2])
+
+            try:
+                encodings = encode_crops([crop for _, _, crops in batch for crop in crops])
+                # one snapshot of the gallery for the whole batch
+                student_ids = Gallery.current().match(encodings)
+            except Exception:
+                traceback.print_exc()
+                student_ids = None
+
+            offset = 0
+            for connection, request_id, crops in batch:
+                result = student_ids[offset:offset + len(crops)] if student_ids is not None else None
+                offset += len(crops)
+                try:
+                    connection.send((request_id, result))
+                except (EOFError, OSError):
+                    pass  # the client is gone
+
+
+class RecognitionServiceClient:
+    """
+    `RecognitionEngine` identifier backed by the recognition service. Falls back to `fallback`
+    (usually the engine's own identify) while the service cannot be reached.
+    """
+
+    def __init__(self, fallback=None, address: str = RECOGNITION_SERVICE_ADDRESS):
+        self.address = address
+        self.fallback = fallback
+        self.connection = None
+        self.retry_at = 0.0
+        self.request_ids = count(1)
+        self.lock = threading.Lock()
+
+    def connect(self) -> Optional[Connection]:
+        if self.connection is None and time.monotonic() >= self.retry_at:
+            try:
+                self.connection = Client(self.address, family="AF_UNIX", authkey=RECOGNITION_SERVICE_AUTHKEY.encode())
+            except (OSError, EOFError) as e:
+                print(f"[ERROR] recognition service unreachable ({e}), identifying faces locally")
+                self.retry_at = time.monotonic() + RECONNECT_SECONDS
+        return self.connection
+
+    def __call__(self, faces: List[Tuple[np.ndarray, List[Box]]]) -> List[Optional[int]]:
+        crops = [crop for rgb, boxes in faces for crop in crop_faces(rgb, boxes)]
+        with self.lock:
+            connection = self.connect()
+            if connection is not None:
+                request_id = next(self.request_ids)
+                try:
+                    connection.send((request_id, crops))
+                    # a service that is alive but stuck must not stop the feed for good
+                    if not connection.poll(RECOGNITION_SERVICE_TIMEOUT):
+                        raise OSError(f"no answer from the recognition service in {RECOGNITION_SERVICE_TIMEOUT}s")
+                    response_id, student_ids = connection.recv()
+                    if response_id != request_id:
+                        raise OSError("recognition service response out of order")
+                    if student_ids is not None:
+                        return student_ids
+                except (OSError, EOFError) as e:
+                    print(f"[ERROR] recognition service failed ({e}), identifying faces locally")
+                    connection.close()
+                    self.connection = None
+                    self.retry_at = time.monotonic() + RECONNECT_SECONDS
+        if self.fallback is None:
+            return [None] * len(crops)
+        return self.fallback(faces)
@@ -0,0 +1,71 @@
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.libs.detectors import Box
+
+# points are (x, y) fractions of the frame width and height, so a region fits any resolution of the feed
+Polygon = List[Tuple[float, float]]
+
+
+class RegionOfInterest:
+    """
+    Polygons of a feed where faces are looked for, a rectangle is a 4 point polygon.
+    Detection only runs on the bounding box of the polygons and faces centred outside them are dropped.
+    """
+
+    def __init__(self, polygons: List[Polygon]):
+        self.polygons = polygons
+        self.masks = {}  # type: Dict[Tuple[int, int], np.ndarray]  # frame (height, width) -> mask
+
+    @staticmethod
+    def validate(value) -> Optional[List[Polygon]]:
+        """Check the JSON of a feed's region, raises ValueError if it is not a list of polygons"""
+        if value is None:
+            return None
+        if not isinstance(value, list) or not value:
+            raise ValueError("roi must be a non empty list of polygons")
+        polygons = []
+        for polygon in value:
+            if not isinstance(polygon, list) or len(polygon) < 3:
+                raise ValueError("a polygon must have at least 3 points")
+            points = []
+            for point in polygon:
+                if not isinstance(point, (list, tuple)) or len(point) != 2 or not all(
+                        isinstance(v, (int, float)) and not isinstance(v, bool) and 0 <= v <= 1 for v in point):
+                    raise ValueError("points must be [x, y] fractions of the frame between 0 and 1")
+                points.append((float(point[0]), float(point[1])))
+            polygons.append(points)
+        return polygons
+
+    @classmethod
+    def from_json(cls, value) -> Optional["RegionOfInterest"]:
+        polygons = cls.validate(value)
+        return cls(polygons) if polygons else None
+
+    def points(self, shape: Tuple[int, ...]) -> List[np.ndarray]:
+        height, width = shape[:2]
+        return [np.array([(x * width, y * height) for x, y in polygon], dtype=np.int32) for polygon in self.polygons]
+
+    def mask(self, shape: Tuple[int, ...]) -> np.ndarray:
+        key = shape[:2]
+        if key not in self.masks:
+            mask = np.zeros(key, dtype=np.uint8)
+            cv2.fillPoly(mask, self.points(shape), 255)
+            self.masks[key] = mask
+        return self.masks[key]
+
+    def bounding_box(self, shape: Tuple[int, ...]) -> Box:
+        """(top, right, bottom, left) pixels of the frame covered by the polygons"""
+        points = np.concatenate(self.points(shape))
+        left, top = points.min(axis=0)
+        right, bottom = points.max(axis=0) + 1
+        return max(int(top), 0), min(int(right), shape[1]), min(int(bottom), shape[0]), max(int(left), 0)
+
+    def contains(self, box: Box, shape: Tuple[int, ...]) -> bool:
+        """Whether the centre of the box is inside the polygons"""
+        top, right, bottom, left = box
+        y = min(max((top + bottom) // 2, 0), shape[0] - 1)
+        x = min(max((left + right) // 2, 0), shape[1] - 1)
+        return bool(self.mask(shape)[y, x])
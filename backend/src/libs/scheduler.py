@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.settings import (
+    ANALYSIS_TARGET_FPS, ANALYSIS_LATENCY_BUDGET, ANALYSIS_MAX_LOAD, ANALYSIS_MIN_SCALE, MOTION_GATE
+)
+from src.libs.motion import MotionGate
+from src.libs.roi import RegionOfInterest
+
+# observed rates are measured over this many seconds
+STATS_WINDOW = 5.0
+# detection scale step when a stream is over or well under its latency budget
+SCALE_STEP = 0.85
+
+
+class FrameScheduler:
+    """
+    Picks the frames of one stream to analyse. A frame is analysed when the interval since the last
+    analysed one reaches `max(1 / target_fps, processing time / max_load)`, so a slow or overloaded stream
+    skips more frames instead of falling behind. When an analysis takes longer than `latency_budget`
+    the detection scale is lowered (down to `min_scale`), and raised again once there is headroom.
+    With a `motion` gate a due frame is skipped too when the scene (within the feed's region of interest)
+    did not change since the last analysis.
+    Every scheduler is registered under its stream id for the stats endpoints.
+    """
+    streams = {}  # stream id -> FrameScheduler
+    lock = threading.Lock()
+
+    def __init__(self, stream_id: str, target_fps: float = ANALYSIS_TARGET_FPS,
+                 latency_budget: float = ANALYSIS_LATENCY_BUDGET, max_load: float = ANALYSIS_MAX_LOAD,
+                 min_scale: float = ANALYSIS_MIN_SCALE, motion: MotionGate = None):
+        self.stream_id = stream_id
+        self.target_fps = target_fps
+        self.latency_budget = latency_budget
+        self.max_load = max_load
+        self.min_scale = min_scale
+        self.motion = motion
+        self.scale = 1.0  # detection scale, multiplies the detection width of the pipeline
+        self.process_time = None  # moving average of the seconds an analysis takes
+        self.next_due = 0.0
+        self.started_at = time.monotonic()
+        self.faces = []  # result of the last analysed frame, reused for skipped frames
+        self.received = deque()  # timestamps of the frames of the last STATS_WINDOW seconds
+        self.analysed = deque()
+        self.skipped = 0
+        self.static = 0  # due frames skipped by the motion gate
+
+    @classmethod
+    def for_stream(cls, stream_id: str, **kwargs) -> "FrameScheduler":
+        """Register a new scheduler for the stream, replacing the one of a previous run"""
+        if MOTION_GATE:
+            kwargs.setdefault("motion", MotionGate())
+        scheduler = cls(str(stream_id), **kwargs)
+        with cls.lock:
+            cls.streams[scheduler.stream_id] = scheduler
+        return scheduler
+
+    @classmethod
+    def remove(cls, stream_id: str):
+        with cls.lock:
+            cls.streams.pop(str(stream_id), None)
+
+    @classmethod
+    def stats_all(cls) -> List[Dict]:
+        with cls.lock:
+            schedulers = list(cls.streams.values())
+        return [scheduler.stats() for scheduler in schedulers]
+
+    @property
+    def interval(self) -> float:
+        """Seconds between two analysed frames at the current load"""
+        interval = 1.0 / self.target_fps if self.target_fps > 0 else 0.0
+        if self.process_time is not None:
+            interval = max(interval, self.process_time / self.max_load)
+        return interval
+
+    def should_process(self, frame: np.ndarray = None, roi: Optional[RegionOfInterest] = None) -> bool:
+        """Called for every frame of the stream, whether this one is to be analysed"""
+        now = time.monotonic()
+        self._count(self.received, now)
+        if now < self.next_due:
+            self.skipped += 1
+            return False
+        self.next_due = now + self.interval
+        if self.motion is not None and frame is not None and not self.motion.changed(frame, roi):
+            self.static += 1
+            return False
+        self._count(self.analysed, now)
+        return True
+
+    def dropped(self):
+        """Count a frame that arrived while the previous one was still being analysed"""
+        self._count(self.received, time.monotonic())
+        self.skipped += 1
+
+    def processed(self, seconds: float):
+        """Report the processing time of an analysed frame"""
+        if self.process_time is None:
+            self.process_time = seconds
+        else:
+            self.process_time = 0.8 * self.process_time + 0.2 * seconds
+
+        # degrade when over budget, recover when load drops
+        if self.process_time > self.latency_budget:
+            self.scale = max(self.scale * SCALE_STEP, self.min_scale)
+        elif self.process_time < 0.5 * self.latency_budget:
+            self.scale = min(self.scale / SCALE_STEP, 1.0)
+
+    @staticmethod
+    def _count(timestamps: deque, now: float):
+        timestamps.append(now)
+        while timestamps[0] < now - STATS_WINDOW:
+            timestamps.popleft()
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        # a stream younger than the window is measured over its lifetime
+        window = max(min(STATS_WINDOW, now - self.started_at), 1e-3)
+
+        def fps(timestamps):
+            return round(sum(1 for t in list(timestamps) if t >= now - window) / window, 2)
+
+        return {
+            "stream": self.stream_id,
+            "target_fps": self.target_fps,
+            "scheduled_fps": round(1.0 / self.interval, 2) if self.interval else None,
+            "observed_fps": fps(self.analysed),
+            "input_fps": fps(self.received),
+            "process_ms": round(self.process_time * 1000, 1) if self.process_time is not None else None,
+            "detection_scale": round(self.scale, 3),
+            "skipped": self.skipped,
+            "static_skipped": self.static,
+        }
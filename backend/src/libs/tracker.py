@@ -0,0 +1,123 @@
+import itertools
+from typing import List
+
+import cv2
+import numpy as np
+
+from src.settings import (
+    TRACK_IOU, TRACK_REENCODE_FRAMES, TRACK_MIN_CONFIDENCE,
+    TRACK_MAX_MISSED, TRACK_OPTICAL_FLOW
+)
+from src.libs.detectors import Box, iou
+
+
+class Track:
+    """One face followed across the frames of a stream"""
+    ids = itertools.count(1)
+
+    def __init__(self, box: Box):
+        self.id = next(Track.ids)
+        self.box = box
+        self.student_id = None  # matched student of the last encoding
+        self.confidence = 0.0  # 1 right after encoding, decays with every frame
+        self.since_encoded = None  # frames since the last encoding, None if never encoded
+        self.missed = 0  # consecutive frames without a detection
+        self.encode = True  # whether the face must be encoded in the current frame
+
+
+class FaceTracker:
+    """
+    IoU tracker of the faces of one stream, so a face that stays in front of the camera is not encoded
+    on every frame. A track is encoded again when it is new, when its identity confidence (the product
+    of the overlaps of its successive boxes) falls below `min_confidence`, or every `reencode_frames`.
+    With `optical_flow` tracks are moved by the Lucas-Kanade flow of the frame before association,
+    which keeps fast moving faces on their track.
+    """
+
+    def __init__(self, min_iou: float = TRACK_IOU, reencode_frames: int = TRACK_REENCODE_FRAMES,
+                 min_confidence: float = TRACK_MIN_CONFIDENCE, max_missed: int = TRACK_MAX_MISSED,
+                 optical_flow: bool = TRACK_OPTICAL_FLOW):
+        self.min_iou = min_iou
+        self.reencode_frames = reencode_frames
+        self.min_confidence = min_confidence
+        self.max_missed = max_missed
+        self.optical_flow = optical_flow
+        self.tracks = []  # type: List[Track]
+        self.previous_gray = None
+        self.encoded = 0  # faces encoded / all detected faces, for stats
+        self.detected = 0
+
+    def update(self, rgb: np.ndarray, boxes: List[Box]) -> List[Track]:
+        """
+        Associate the detected boxes of the next frame with the tracks, returns the track of every box.
+        Boxes are in the coordinates of the full frame, so the detection scale may change between frames.
+        """
+        if self.optical_flow:
+            gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+            if self.previous_gray is not None and self.previous_gray.shape == gray.shape:
+                for track in self.tracks:
+                    track.box = self.flow(self.previous_gray, gray, track.box)
+            self.previous_gray = gray
+
+        # greedy association, best overlaps first
+        pairs = sorted(
+            ((iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)),
+            reverse=True
+        )
+        assigned = {}  # box index -> track
+        used = set()
+        for overlap, t, b in pairs:
+            if overlap < self.min_iou:
+                break
+            if b in assigned or t in used:
+                continue
+            track = self.tracks[t]
+            track.confidence *= overlap
+            assigned[b] = track
+            used.add(t)
+
+        for t, track in enumerate(self.tracks):
+            if t not in used:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        result = []
+        for b, box in enumerate(boxes):
+            track = assigned.get(b)
+            if track is None:
+                track = Track(box)
+                self.tracks.append(track)
+            track.box = box
+            track.missed = 0
+            track.encode = (
+                track.since_encoded is None
+                or track.confidence < self.min_confidence
+                or track.since_encoded + 1 >= self.reencode_frames
+            )
+            if track.encode:
+                track.since_encoded = 0
+                track.confidence = 1.0
+            else:
+                track.since_encoded += 1
+            result.append(track)
+
+        self.detected += len(result)
+        self.encoded += sum(track.encode for track in result)
+        return result
+
+    @staticmethod
+    def flow(previous: np.ndarray, current: np.ndarray, box: Box) -> Box:
+        """Shift the box by the median optical flow of the corners found inside it"""
+        top, right, bottom, left = box
+        mask = np.zeros_like(previous)
+        mask[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = 255
+        points = cv2.goodFeaturesToTrack(previous, maxCorners=30, qualityLevel=0.01, minDistance=3, mask=mask)
+        if points is None:
+            return box
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(previous, current, points, None)
+        good = status.ravel() == 1
+        if not good.any():
+            return box
+        dx, dy = np.median((moved - points).reshape(-1, 2)[good], axis=0)
+        dx, dy = int(round(dx)), int(round(dy))
+        return top + dy, right + dx, bottom + dy, left + dx
@@ -1,76 +1,321 @@
 import os
-import pickle
+import json
+import time
+import hashlib
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import cv2
+import numpy as np
 import face_recognition
 
-from src.settings import DATASET_PATH, ENCODINGS_FILE, DLIB_MODEL
+from src.settings import (
+    DATASET_PATH, ENCODINGS_FILE, TRAIN_DETECTOR,
+    FACE_INDEX, FACE_INDEX_FILE, TRAIN_MANIFEST_FILE,
+    TRAIN_WORKERS, TRAIN_MAX_IN_FLIGHT, FACE_QUALITY_GATE,
+    PROTOTYPES_FILE, PROTOTYPES_PER_STUDENT, PROTOTYPE_METHOD
+)
+from src.libs.detectors import get_detector
+from src.libs.encodings_store import EncodingsStore, ENCODING_DIM
+from src.libs.face_quality import FaceQualityGate
+from src.libs.face_index import BruteForceIndex, build_index, kmeans, squared_distances
+
+MANIFEST_VERSION = 1
+
+
+def file_hash(path: str) -> str:
+    """sha1 of the file content, used to tell a touched image from a changed one"""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
 
 
 class TrainClassifier:
-    """Train KNN Classifier by storing results in `files/encodings.pickle` file"""
-    # TODO: Store encodings in SQL database rather than `files/encodings.pickle` file
+    """
+    Train KNN Classifier by storing results in `files/encodings.bin` store.
+
+    `files/train_manifest.json` records for every dataset image its (size, mtime, sha1) and how many
+    encodings it produced, so a run only encodes new or changed images and drops the rows of deleted ones.
+    It also records the face quality thresholds, the whole dataset is encoded again when they change.
+    Store rows are sorted by (student id, image path), that order maps every image to its rows.
+    """
+    # TODO: Store encodings in SQL database rather than `files/encodings.bin` store
     @classmethod
-    def train(cls):
-        try:
-            print("[INFO] loading encodings...")
-            with open(ENCODINGS_FILE, "rb") as ef:
-                data = pickle.loads(ef.read())
-            # initialize the list of known encodings and known names
-            known_encodings = data["encodings"]
-            known_ids = data["ids"]
-        except FileNotFoundError:
-            # initialize the list of known encodings and known names
-            known_encodings = []
-            known_ids = []
-
-        # get single unique ids by converting into set
-        # for each _id convert it into int
-        unique_ids = [int(_id) for _id in set(known_ids)]
-
-        # get all id_paths and join the path of the parent folder to each id_path
-        id_paths = [os.path.join(DATASET_PATH, f) for f in os.listdir(DATASET_PATH)]
-        # print(">>> ID paths:", id_paths)
-
-        # now looping through all the id_paths and loading the images in that id_path
-        for id_path in id_paths:
-            # getting the ID from the image
-            _id = int(os.path.split(id_path)[1])
-            if _id in unique_ids:
-                continue
-            # grab the paths to the input images of that ID
-            image_paths = [os.path.join(id_path, f) for f in os.listdir(id_path)]
-            for i, image_path in enumerate(image_paths):
-                print(f"[INFO] ID: {_id}, processing image {i + 1}/{len(image_paths)}")
-                # load the input image and convert it from RGB (OpenCV ordering)
-                # to dlib ordering (RGB)
-                image = cv2.imread(image_path)
-                try:
-                    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                except cv2.error:
-                    # delete image that cannot be processed
-                    try:
-                        os.remove(image_path)
-                    except (FileNotFoundError, PermissionError):
-                        pass
+    def train(cls, image_paths: Iterable[str] = None, workers: int = TRAIN_WORKERS):
+        """
+        Bring the encodings up to date with the dataset. When `image_paths` is given only those
+        images are checked (e.g. a single upload) instead of scanning the whole dataset.
+        With `workers` > 1 the images are encoded by a pool of processes, 0 uses every core.
+        """
+        print("[INFO] loading encodings...")
+        entries, rows, changed = cls.load()
+
+        # a store that is out of sync with the manifest can only be rebuilt from the whole dataset
+        if image_paths is None or changed:
+            candidates = cls.scan_dataset()
+            # images that are no longer in the dataset lose their encodings
+            for key in set(entries) - set(candidates):
+                del entries[key]
+                changed = True
+        else:
+            candidates = {}
+            for image_path in image_paths:
+                key = cls.manifest_key(image_path)
+                # only images inside an <id> folder of the dataset belong to a student
+                if not key.split("/")[0].isdigit():
                     continue
+                if os.path.isfile(image_path):
+                    candidates[key] = os.stat(image_path)
+                elif entries.pop(key, None):
+                    changed = True
+
+        # images to encode, in a deterministic order whatever the order of the directory listing
+        pending = []
+        for key in sorted(candidates):
+            stat = candidates[key]
+            entry = entries.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                continue
+            sha1 = file_hash(os.path.join(DATASET_PATH, key))
+            if entry and entry["sha1"] == sha1:
+                # only touched, keep the encodings but remember the new stat
+                entry.update(size=stat.st_size, mtime=stat.st_mtime)
+                changed = True
+                continue
+            pending.append((key, stat, sha1))
+
+        image_paths = [os.path.join(DATASET_PATH, key) for key, _, _ in pending]
+        rejected = Counter()
+        # the generator goes first in zip() so it runs to completion and shuts its pool down
+        for result, (key, stat, sha1) in zip(cls.encode_images(image_paths, workers), pending):
+            changed = True
+            if result is None:
+                # the image was deleted because it cannot be processed
+                entries.pop(key, None)
+                continue
+            encodings, reasons = result
+            rejected.update(reasons)
+            entries[key] = {
+                "id": int(key.split("/")[0]),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha1": sha1,
+                "count": len(encodings),
+            }
+            rows[key] = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+
+        if rejected:
+            print("[INFO] faces kept out of the gallery: " + ", ".join(f"{n} {r}" for r, n in rejected.items()))
+        if changed:
+            cls.save(entries, rows)
+        else:
+            print("[INFO] encodings are up to date")
+
+    @classmethod
+    def remove_student(cls, student_id: int):
+        """Drop every encoding of a student together with its manifest entries"""
+        entries, rows, stale = cls.load()
+        if stale:
+            # the student's folder is already gone, so a full run drops its encodings
+            return cls.train()
+        removed = [key for key, entry in entries.items() if entry["id"] == student_id]
+        for key in removed:
+            del entries[key]
+        if removed:
+            cls.save(entries, rows)
+
+    @staticmethod
+    def manifest_key(image_path: str) -> str:
+        """Path of the image relative to the dataset, e.g. `<id>/<filename>`"""
+        return os.path.relpath(image_path, DATASET_PATH).replace(os.sep, "/")
+
+    @staticmethod
+    def scan_dataset() -> Dict[str, os.stat_result]:
+        """stat of every image in the dataset, keyed by manifest key"""
+        images = {}
+        if not os.path.isdir(DATASET_PATH):
+            return images
+        for id_dir in os.scandir(DATASET_PATH):
+            # only <id> folders hold student images
+            if not id_dir.is_dir() or not id_dir.name.isdigit():
+                continue
+            for image in os.scandir(id_dir.path):
+                if image.is_file():
+                    images[f"{id_dir.name}/{image.name}"] = image.stat()
+        return images
+
+    @classmethod
+    def encode_images(cls, image_paths: List[str], workers: int = TRAIN_WORKERS) -> \
+            Iterator[Optional[Tuple[List[np.ndarray], List[str]]]]:
+        """
+        Yield the encodings and reject reasons of every image in the order of `image_paths`. With several workers
+        at most `workers * TRAIN_MAX_IN_FLIGHT` images are queued on the pool at any time.
+        """
+        workers = workers or os.cpu_count() or 1
+        workers = min(workers, len(image_paths))
+        start = last_report = time.perf_counter()
+
+        def progress(done: int):
+            nonlocal last_report
+            now = time.perf_counter()
+            if done == len(image_paths) or now - last_report >= 2:
+                last_report = now
+                print(f"[INFO] encoded {done}/{len(image_paths)} images "
+                      f"({done / max(now - start, 1e-9):.1f} images/s)")
+
+        if workers <= 1:
+            for done, image_path in enumerate(image_paths, 1):
+                encodings = cls.encode_image(image_path)
+                progress(done)
+                yield encodings
+            return
+
+        print(f"[INFO] encoding {len(image_paths)} images with {workers} processes...")
+        # spawned rather than forked, training runs on a thread of the threaded server whose other
+        # threads may hold locks (database pool, gallery, logging) a forked child would inherit held
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            in_flight = deque()
+            paths = iter(image_paths)
+            done = 0
+            while True:
+                # keep the pool busy without queueing the whole dataset at once
+                while len(in_flight) < workers * TRAIN_MAX_IN_FLIGHT:
+                    image_path = next(paths, None)
+                    if image_path is None:
+                        break
+                    in_flight.append(pool.submit(cls.encode_image, image_path))
+                if not in_flight:
+                    break
+                # results are consumed in submission order, so the output does not depend on scheduling
+                encodings = in_flight.popleft().result()
+                done += 1
+                progress(done)
+                yield encodings
+
+    @staticmethod
+    def encode_image(image_path: str) -> Optional[Tuple[List[np.ndarray], List[str]]]:
+        """
+        Encodings of the faces of the image that pass the quality gate and the reject reasons of the others,
+        None (and the image is removed) if it cannot be read
+        """
+        # load the input image and convert it from RGB (OpenCV ordering)
+        # to dlib ordering (RGB)
+        image = cv2.imread(image_path)
+        try:
+            rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        except cv2.error:
+            # delete image that cannot be processed
+            try:
+                os.remove(image_path)
+            except (FileNotFoundError, PermissionError):
+                pass
+            return None
+
+        # detect the (x, y)-coordinates of the bounding boxes
+        # corresponding to each face in the input frame, then compute
+        # the facial embeddings for each face
+        boxes = get_detector(TRAIN_DETECTOR)(rgb)
+        reasons = []
+        if FACE_QUALITY_GATE:
+            # keep blurred, dark or turned faces out of the gallery
+            gate = FaceQualityGate("training")
+            reasons = [gate.reject_reason(rgb, box) for box in boxes]
+            boxes = [box for box, reason in zip(boxes, reasons) if reason is None]
+        # compute the facial embedding for the face
+        return face_recognition.face_encodings(rgb, boxes), [reason for reason in reasons if reason]
+
+    @staticmethod
+    def compact(encodings: np.ndarray, ids: np.ndarray, k: int = PROTOTYPES_PER_STUDENT,
+                method: str = PROTOTYPE_METHOD):
+        """
+        Reduce the encodings of every student to at most `k` prototypes: k-means centroids, or with
+        "medoid" the real sample closest to each centroid. `ids` must be sorted like the store.
+        """
+        ids = np.asarray(ids)
+        unique_ids, starts = np.unique(ids, return_index=True)
+        ends = np.append(starts[1:], len(ids))
+        prototypes = []
+        prototype_ids = []
+        for _id, start, end in zip(unique_ids, starts, ends):
+            samples = np.asarray(encodings[start:end], dtype=np.float32)
+            if len(samples) > k:
+                centroids, _ = kmeans(samples, k)
+                if method == "medoid":
+                    samples = samples[np.unique(squared_distances(centroids, samples).argmin(axis=1))]
+                else:
+                    samples = centroids
+            prototypes.append(samples)
+            prototype_ids.append(np.full(len(samples), _id))
+        return np.concatenate(prototypes), np.concatenate(prototype_ids)
+
+    @staticmethod
+    def load_manifest() -> Dict:
+        try:
+            with open(TRAIN_MANIFEST_FILE) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest
+
+    @classmethod
+    def load(cls):
+        """
+        Manifest entries, the store rows of every entry and whether the store must be rewritten.
+        If the manifest does not describe the store (first run, migrated pickle, interrupted write)
+        both are discarded and the dataset is encoded again.
+        """
+        manifest = cls.load_manifest()
+        entries = manifest.get("images", {})
+        store = EncodingsStore.load(ENCODINGS_FILE)
+        if sum(entry["count"] for entry in entries.values()) != len(store):
+            print("[INFO] encodings do not match the training manifest, encoding the whole dataset")
+            return {}, {}, True
+        if len(store) and store.model != TRAIN_DETECTOR:
+            print(f"[INFO] encodings were detected with {store.model}, encoding the whole dataset with {TRAIN_DETECTOR}")
+            return {}, {}, True
+        if len(store) and manifest.get("quality_gate") != FaceQualityGate.signature():
+            # samples kept by other thresholds (or by no gate at all) would stay in the gallery otherwise
+            print("[INFO] encodings were gated with other face quality settings, encoding the whole dataset")
+            return {}, {}, True
+
+        rows = {}
+        offset = 0
+        for key in sorted(entries, key=lambda k: (entries[k]["id"], k)):
+            count = entries[key]["count"]
+            rows[key] = store.encodings[offset:offset + count]
+            offset += count
+        return entries, rows, False
+
+    @classmethod
+    def save(cls, entries: Dict[str, Dict], rows: Dict[str, np.ndarray]):
+        # keep the gallery sorted by (id, path), the matcher, the index and the manifest rely on that order
+        keys = sorted(entries, key=lambda k: (entries[k]["id"], k))
+        known_encodings = np.concatenate(
+            [np.asarray(rows[key], dtype=np.float32) for key in keys] + [np.empty((0, ENCODING_DIM), np.float32)]
+        )
+        known_ids = np.repeat([entries[key]["id"] for key in keys], [entries[key]["count"] for key in keys])
 
-                # detect the (x, y)-coordinates of the bounding boxes
-                # corresponding to each face in the input frame, then compute
-                # the facial embeddings for each face
-                boxes = face_recognition.face_locations(rgb, model=DLIB_MODEL)
-                # compute the facial embedding for the face
-                encodings = face_recognition.face_encodings(rgb, boxes)
-                # loop over the encodings
-                for encoding in encodings:
-                    # add each encoding + name to our set of known names and
-                    # encodings
-                    known_encodings.append(encoding)
-                    known_ids.append(_id)
+        # build the nearest neighbour index over the new gallery and save it next to the encodings,
+        # it is written first so a recognizer reloading the new store always finds its index
+        if FACE_INDEX != BruteForceIndex.kind and len(known_ids):
+            print(f"[INFO] building {FACE_INDEX} index...")
+            build_index(known_encodings, FACE_INDEX).save(FACE_INDEX_FILE)
+        if PROTOTYPES_PER_STUDENT and len(known_ids):
+            prototypes, prototype_ids = cls.compact(known_encodings, known_ids)
+            EncodingsStore.write(prototypes, prototype_ids, PROTOTYPES_FILE)
+            print(f"[INFO] {len(prototype_ids)} prototypes for {len(known_ids)} encodings "
+                  f"(shrink factor {len(known_ids) / len(prototype_ids):.1f}x)")
 
         # dump the facial encodings + names to disk
         print("[INFO] serializing encodings...")
-        data = {"encodings": known_encodings, "ids": known_ids}
-        f = open(ENCODINGS_FILE, "wb")
-        f.write(pickle.dumps(data))
-        f.close()
+        EncodingsStore.write(known_encodings, known_ids, ENCODINGS_FILE, model=TRAIN_DETECTOR)
+        tmp_path = f"{TRAIN_MANIFEST_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "quality_gate": FaceQualityGate.signature(), "images": entries}, f)
+        os.replace(tmp_path, TRAIN_MANIFEST_FILE)
@@ -0,0 +1,118 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+from uuid import uuid4
+
+from src.libs.gallery import Gallery
+from src.libs.train_classifier import TrainClassifier
+
+# finished jobs kept around so their status can still be queried
+MAX_FINISHED_JOBS = 100
+
+
+class TrainingJob:
+    """One training run, collecting every trigger that arrived while it was queued"""
+
+    def __init__(self):
+        self.id = uuid4().hex
+        self.status = "queued"  # queued -> running -> done / failed
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.triggers = 0
+        # None means a full dataset scan, otherwise only these images are checked
+        self.image_paths = set()
+        self.removed_students = set()
+
+    def add(self, image_paths: Optional[Iterable[str]], remove_student: Optional[int]):
+        self.triggers += 1
+        if remove_student is not None:
+            self.removed_students.add(remove_student)
+        elif image_paths is None:
+            self.image_paths = None
+        elif self.image_paths is not None:
+            self.image_paths.update(image_paths)
+
+    def to_dict(self) -> Dict:
+        now = time.time()
+        started = self.started_at or now
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "triggers": self.triggers,
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wait_seconds": round(started - self.queued_at, 3),
+            "run_seconds": round((self.finished_at or now) - started, 3) if self.started_at else None,
+        }
+
+
+class TrainingQueue:
+    """
+    Single writer of the encodings store. Upload and delete endpoints only submit a trigger and return,
+    a background thread runs the training. Triggers arriving while a job is still queued are coalesced
+    into that job, so a burst of uploads costs one training run.
+    """
+    jobs = OrderedDict()  # job id -> TrainingJob, oldest first
+    pending = None  # the queued job new triggers are merged into
+    condition = threading.Condition()
+    thread = None
+
+    @classmethod
+    def submit(cls, image_paths: Iterable[str] = None, remove_student: int = None) -> TrainingJob:
+        """Queue training of `image_paths` (all images when None) or removal of a student's encodings"""
+        with cls.condition:
+            if cls.pending is None:
+                cls.pending = TrainingJob()
+                cls.jobs[cls.pending.id] = cls.pending
+                cls._prune()
+            job = cls.pending
+            job.add(image_paths, remove_student)
+
+            if cls.thread is None or not cls.thread.is_alive():
+                cls.thread = threading.Thread(target=cls._worker, name="training-queue", daemon=True)
+                cls.thread.start()
+            cls.condition.notify()
+        return job
+
+    @classmethod
+    def find_by_id(cls, job_id: str) -> Optional[TrainingJob]:
+        return cls.jobs.get(job_id)
+
+    @classmethod
+    def _prune(cls):
+        finished = [job_id for job_id, job in cls.jobs.items() if job.finished_at]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del cls.jobs[job_id]
+
+    @classmethod
+    def _worker(cls):
+        while True:
+            with cls.condition:
+                while cls.pending is None:
+                    cls.condition.wait()
+                # from now on new triggers go to a new job
+                job, cls.pending = cls.pending, None
+
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                for student_id in job.removed_students:
+                    TrainClassifier.remove_student(student_id)
+                if job.image_paths is None or job.image_paths:
+                    TrainClassifier.train(None if job.image_paths is None else sorted(job.image_paths))
+                # recognizers of this process switch to the new encodings from their next frame
+                if Gallery.matcher is not None:
+                    Gallery.reload(force=True)
+                job.status = "done"
+            except Exception as e:
+                traceback.print_exc()
+                job.status = "failed"
+                job.error = str(e)
+            job.finished_at = time.time()
+            print(f"[INFO] training job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s")
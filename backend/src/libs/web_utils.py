@@ -1,31 +1,85 @@
-import pickle
-from typing import Dict
-from datetime import date as dt
-
 import cv2
-import imutils
 import numpy as np
-import face_recognition
 
-from src.settings import (
-    DLIB_MODEL, DLIB_TOLERANCE,
-    ENCODINGS_FILE
-)
 from src.libs.base_camera import BaseCamera
-from src.models import StudentModel, AttendanceModel
+from src.libs.capture import FrameGrabber
+from src.libs.detectors import create_detector
+from src.libs.gallery import Gallery
+from src.libs.recognition import RecognitionEngine
+from src.libs.recognition_service import RecognitionServiceClient
+from src.libs.roi import RegionOfInterest
+from src.libs.scheduler import FrameScheduler
+from src.libs.tracker import FaceTracker
+from src.libs.workers import AsyncRecognizer, PoolDetector, pool_encode_faces
+from src.settings import CAMERA_DETECT_WIDTH, CAMERA_DETECT_UPSAMPLE, FACE_DETECTOR, RECOGNITION_BACKEND, TRACKING
 
 
 class RecognitionCamera(BaseCamera):
     video_source = 0
-    # this class variable will help to process every other frame of video to save time
-    process_this_frame = True
+    detectors = {}  # feed id -> face detector name
+    rois = {}  # feed id -> RegionOfInterest, None for the whole frame
 
     @classmethod
     def set_video_source(cls, source):
         cls.video_source = source
 
     @classmethod
-    def frames(cls):
+    def set_detector(cls, unique_id, detector: str = None):
+        cls.detectors[unique_id] = detector or FACE_DETECTOR
+
+    @classmethod
+    def set_roi(cls, unique_id, roi=None):
+        """Region of interest of the feed as stored in `VideoFeedModel.roi`, applied from the next frame"""
+        cls.rois[unique_id] = RegionOfInterest.from_json(roi)
+
+    @classmethod
+    def frames(cls, unique_id=None):
+        if RECOGNITION_BACKEND == "inline":
+            yield from cls.inline_frames(unique_id)
+            return
+
+        detector = cls.detectors.get(unique_id, FACE_DETECTOR)
+        print(f"[INFO] starting video stream with {detector} face detector...")
+        # the camera is drained on its own thread, previews stream at capture rate
+        grabber = FrameGrabber(cls.video_source)
+
+        print("[INFO] loading encodings...")
+        Gallery.current()
+
+        if RECOGNITION_BACKEND == "service":
+            # faces are identified by the recognition service, only detection runs here
+            engine = RecognitionEngine(
+                detector=create_detector(detector, CAMERA_DETECT_UPSAMPLE), detect_width=CAMERA_DETECT_WIDTH,
+                name=f"feed-{unique_id}"
+            )
+            engine.identifier = RecognitionServiceClient(fallback=engine.identify)
+        else:
+            # detection and encoding run on the recognition workers shared by every feed
+            engine = RecognitionEngine(
+                detector=PoolDetector(detector, CAMERA_DETECT_UPSAMPLE), encoder=pool_encode_faces,
+                detect_width=CAMERA_DETECT_WIDTH, name=f"feed-{unique_id}"
+            )
+        recognizer = AsyncRecognizer(
+            engine, FaceTracker() if TRACKING else None, FrameScheduler.for_stream(unique_id)
+        )
+        try:
+            sequence = 0
+            while True:
+                sequence, img = grabber.read(sequence)
+                if img is None:
+                    break
+                engine.roi = cls.rois.get(unique_id)
+                recognizer.offer(img)
+                # annotations of the last recognized frame come back asynchronously
+                engine.annotate(img, recognizer.faces)
+                yield cv2.imencode('.jpg', img)[1].tobytes()
+        finally:
+            recognizer.stop()
+            grabber.stop()
+            FrameScheduler.remove(unique_id)
+
+    @classmethod
+    def inline_frames(cls, unique_id=None):
         print("[INFO] starting video stream...")
         camera = cv2.VideoCapture(cls.video_source)
 
@@ -34,97 +88,32 @@ class RecognitionCamera(BaseCamera):
             raise RuntimeError('Could not start camera.')
 
         print("[INFO] loading encodings...")
-        data = pickle.loads(open(ENCODINGS_FILE, "rb").read())
-        # print(len(data['encodings']) == len(data['ids']))
-
-        # create in dictionary for known students from database to avoid multiple queries
-        known_students = {}
-        while True:
-            # read current frame
-            _, img = camera.read()
-            yield cls.recognize_n_attendance(img, data, known_students)
+        Gallery.current()
+
+        # frames are resized to have a width of CAMERA_DETECT_WIDTH before detection (to speedup processing)
+        engine = RecognitionEngine(
+            detector=create_detector(cls.detectors.get(unique_id, FACE_DETECTOR), CAMERA_DETECT_UPSAMPLE),
+            detect_width=CAMERA_DETECT_WIDTH, name=f"feed-{unique_id}"
+        )
+        # faces staying in front of the camera are not encoded again on every frame
+        tracker = FaceTracker() if TRACKING else None
+        # each feed picks the frames it analyses from its own measured processing time
+        scheduler = FrameScheduler.for_stream(unique_id)
+        try:
+            while True:
+                # read current frame
+                _, img = camera.read()
+                engine.roi = cls.rois.get(unique_id)
+                yield cls.recognize_n_attendance(img, engine, tracker, scheduler)
+        finally:
+            FrameScheduler.remove(unique_id)
+            camera.release()
 
     @classmethod
-    def recognize_n_attendance(cls, frame: np.ndarray,
-        data: Dict, known_students: Dict) -> bytes:
-        # convert the input frame from BGR to RGB then resize it to have
-        # a width of 750px (to speedup processing)
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        rgb = imutils.resize(rgb_frame, width=750)
-        r = frame.shape[1] / float(rgb.shape[1])
-
-        boxes = []
-        encodings = []
-        names = []
-
-        # Only process every other frame of video to save time
-        if cls.process_this_frame:
-            # detect the (x, y)-coordinates of the bounding boxes
-            # corresponding to each face in the input frame, then compute
-            # the facial embeddings for each face
-            boxes = face_recognition.face_locations(rgb, model=DLIB_MODEL)
-
-            encodings = face_recognition.face_encodings(rgb, boxes)
-
-            # loop over the facial embeddings
-            for encoding in encodings:
-                # attempt to match each face in the input image to our known encodings
-                matches = face_recognition.compare_faces(data["encodings"], encoding, DLIB_TOLERANCE)
-                # name to be displayed on video
-                display_name = "Unknown"
-
-                # check to see if we have found a match
-                if True in matches:
-                    # find the indexes of all matched faces then initialize a
-                    # dictionary to count the total number of times each face
-                    # was matched
-                    matched_indexes = [i for (i, b) in enumerate(matches) if b]
-                    counts = {}
-
-                    # loop over the matched indexes and maintain a count for
-                    # each recognized face
-                    for matched_index in matched_indexes:
-                        _id = data["ids"][matched_index]
-                        counts[_id] = counts.get(_id, 0) + 1
-
-                    # determine the recognized face with the largest number
-                    # of votes (note: in the event of an unlikely tie Python
-                    # will select first entry in the dictionary)
-                    _id = max(counts, key=counts.get)
-                    if _id:
-                        if _id in known_students.keys():
-                            # find matched student in the known_students by id
-                            student = known_students[_id]
-                        else:
-                            # find matched student in the database by id
-                            student = StudentModel.find_by_id(_id)
-                            known_students[_id] = student
-                            # if student's attendance is not marked
-                            if not AttendanceModel.is_marked(dt.today(), student):
-                                # then mark student's attendance
-                                student_attendance = AttendanceModel(student=student)
-                                # commit changes to database
-                                student_attendance.save_to_db()
-                        # update displayed name to student's name
-                        display_name = student.name
-                # append the name to be displayed in names list
-                names.append(display_name)
-        cls.process_this_frame = not cls.process_this_frame
-        # loop over the recognized faces
-        for ((top, right, bottom, left), display_name) in zip(boxes, names):
-            if display_name == "Unknown":
-                continue
-            # rescale the face coordinates
-            top = int(top * r)
-            right = int(right * r)
-            bottom = int(bottom * r)
-            left = int(left * r)
-            top_left = (left, top)
-            bottom_right = (right, bottom)
-
-            # draw the predicted face name on the image
-            cv2.rectangle(frame, top_left, bottom_right, (0, 255, 0), 2)
-            y = top - 15 if top - 15 > 15 else top + 15
-            cv2.putText(frame, display_name, (left, y), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
+    def recognize_n_attendance(cls, frame: np.ndarray, engine: RecognitionEngine,
+        tracker: FaceTracker = None, scheduler: FrameScheduler = None) -> bytes:
+        # skipped frames show the faces of the last analysed frame
+        faces = engine.process_stream(frame, tracker, scheduler)
+        engine.annotate(frame, faces)
         # display the output frames to the screen
         return cv2.imencode('.jpg', frame)[1].tobytes()
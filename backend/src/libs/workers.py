@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+
+from src.settings import FACE_DETECTOR, RECOGNITION_WORKERS
+from src.libs.detectors import Box, FaceDetector
+from src.libs.face_encoding import crop_faces, detect_faces, encode_crops
+from src.libs.recognition import RecognitionEngine, RecognizedFace
+from src.libs.scheduler import FrameScheduler
+from src.libs.tracker import FaceTracker
+
+
+class RecognitionWorkers:
+    """
+    Process pool running the dlib stages for every feed of the process, so feeds use every core
+    instead of sharing one through the GIL. Started on first use with RECOGNITION_WORKERS processes.
+    """
+    pool = None
+    lock = threading.Lock()
+
+    @classmethod
+    def submit(cls, fn, *args) -> Future:
+        with cls.lock:
+            if cls.pool is None:
+                workers = RECOGNITION_WORKERS or os.cpu_count() or 1
+                print(f"[INFO] starting {workers} recognition workers...")
+                # spawned rather than forked, the server already runs threads holding locks
+                cls.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return cls.pool.submit(fn, *args)
+
+
+class PoolDetector(FaceDetector):
+    """Detector `name` running on the recognition workers"""
+
+    def __init__(self, name: str = FACE_DETECTOR, upsample: int = 1):
+        self.name = name
+        self.upsample = upsample
+
+    def __call__(self, rgb: np.ndarray) -> List[Box]:
+        return RecognitionWorkers.submit(detect_faces, rgb, self.name, self.upsample).result()
+
+
+def pool_encode_faces(rgb: np.ndarray, boxes: List[Box]) -> List[np.ndarray]:
+    """`encode_faces` running on the recognition workers, only the face crops are sent"""
+    if not boxes:
+        return []
+    return RecognitionWorkers.submit(encode_crops, crop_faces(rgb, boxes)).result()
+
+
+class AsyncRecognizer:
+    """
+    Runs the engine on its own thread for one stream. The stream offers every frame and carries on,
+    the recognizer takes the frame when it is idle and the scheduler wants one, and the stream draws
+    the latest `faces` whenever they come back.
+    """
+
+    def __init__(self, engine: RecognitionEngine, tracker: FaceTracker = None, scheduler: FrameScheduler = None):
+        self.engine = engine
+        self.tracker = tracker
+        self.scheduler = scheduler
+        self.faces = []  # type: List[RecognizedFace]
+        self.pending = None
+        self.busy = False
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="recognizer", daemon=True)
+        self.thread.start()
+
+    def offer(self, frame: np.ndarray) -> bool:
+        """Hand the frame over if the recognizer takes it, the frame is copied so the caller may draw on it"""
+        with self.condition:
+            if self.busy or self.pending is not None:
+                if self.scheduler:
+                    self.scheduler.dropped()
+                return False
+            if self.scheduler and not self.scheduler.should_process(frame, self.engine.roi):
+                return False
+            self.pending = frame.copy()
+            self.condition.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame, self.pending = self.pending, None
+                self.busy = True
+
+            started = time.perf_counter()
+            try:
+                scale = self.scheduler.scale if self.scheduler else 1.0
+                self.faces = self.engine.process([frame], self.tracker, scale)[0]
+            except Exception:
+                traceback.print_exc()
+            if self.scheduler:
+                self.scheduler.processed(time.perf_counter() - started)
+            with self.condition:
+                self.busy = False
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
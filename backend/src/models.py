@@ -1,11 +1,14 @@
-from typing import List
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 from uuid import uuid4
-from datetime import date as dt, datetime as dtime, time
+from datetime import date as dt, datetime as dtime, time, timedelta
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, TIMESTAMP, ForeignKey, Time
+from sqlalchemy import (
+    Column, Integer, String, Boolean, Date, DateTime, TIMESTAMP, ForeignKey, Time, JSON, Index, UniqueConstraint,
+    and_, inspect, literal, text
+)
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy.sql import func
 
 
 from src.db import Session, engine
@@ -69,6 +72,50 @@ class StudentModel(Base):
     @classmethod
     def find_all(cls) -> List["StudentModel"]:
         return Session.query(cls).all()
+
+    @classmethod
+    def names(cls, ids: Iterable[int] = None) -> Dict[int, str]:
+        """id -> name of every student (or of the students of `ids`), without loading the models"""
+        query = Session.query(cls.id, cls.name)
+        if ids is not None:
+            query = query.filter(cls.id.in_(list(ids)))
+        return dict(query.all())
+
+    @classmethod
+    def attendance_history(cls, after: int = None, limit: int = None, start: dt = None, end: dt = None,
+                           student_ids: List[int] = None) -> List[Tuple[int, str, Optional[dtime]]]:
+        """
+        (id, name, attendance date) of a page of students ordered by id, then by date; students without
+        attendance between `start` and `end` come once with a None date. One query: the page of students
+        is a subquery, so `limit` counts students, and the join walks the (student_id, day) index.
+        """
+        students = Session.query(cls.id, cls.name)
+        if after is not None:
+            students = students.filter(cls.id > after)
+        if student_ids:
+            students = students.filter(cls.id.in_(student_ids))
+        page = students.order_by(cls.id).limit(limit).subquery()
+        joined = [AttendanceModel.student_id == page.c.id]
+        if start:
+            joined.append(AttendanceModel.day >= start)
+        if end:
+            joined.append(AttendanceModel.day <= end)
+        return Session.query(page.c.id, page.c.name, AttendanceModel.date).outerjoin(
+            AttendanceModel, and_(*joined)
+        ).order_by(page.c.id, AttendanceModel.date).all()
+
+    @classmethod
+    def status_on(cls, day: dt, late_after: dtime) -> List[Tuple[int, str, Optional[dtime], Optional[bool]]]:
+        """
+        (id, name, attendance date, late) of every student on `day`, date and late are None when absent.
+        One join on the (student_id, day) index, whatever the length of the history.
+        """
+        return Session.query(
+            cls.id, cls.name, AttendanceModel.date, AttendanceModel.date > late_after
+        ).outerjoin(
+            AttendanceModel, and_(AttendanceModel.student_id == cls.id, AttendanceModel.day == day)
+        ).order_by(cls.id).all()
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -91,8 +138,15 @@ class AttendanceModel(Base):
 
     # id = Column(String(50), default=uuid4().hex, primary_key=True)
     # time = Column(TIMESTAMP(timezone=False), default=dtime.now)
-    date = Column(DateTime(timezone=True), default=dtime.now, primary_key=True)  # default=func.now
-    student_id = Column(Integer, ForeignKey("students.id"))
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    date = Column(DateTime(timezone=True), default=dtime.now, nullable=False)  # time of the first recognition
+    day = Column(Date, nullable=False)  # day of `date`, stored so lookups by day can use an index
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    # a student is marked once per day, the constraint's index also serves per student queries
+    __table_args__ = (
+        UniqueConstraint("student_id", "day", name="uq_attendances_student_day"),
+        Index("ix_attendances_day_student", "day", "student_id"),
+    )
     # creates AttendanceModel.students as list and
     # backref StudentModel.attendances as AppenderQuery object
     # which can be accessed by StudentModel.attendances.all()
@@ -102,6 +156,11 @@ class AttendanceModel(Base):
     #     foreign_keys="StudentModel.id",
     #     backref=backref("attendances", lazy="dynamic")
     # )
+
+    def __init__(self, date: dtime = None, **kwargs):
+        date = date or dtime.now()
+        super().__init__(date=date, day=date.date(), **kwargs)
+
     @classmethod
     def exists_by_id(cls, _id: int) -> bool:
         return Session.query(cls).filter_by(student_id=_id).first()
@@ -126,15 +185,43 @@ class AttendanceModel(Base):
         #     print(f"Date: {x.AttendanceModel.date} Name: {x.StudentModel.name} Time: {x.AttendanceModel.time}")
         return Session.query(cls).all()
 
+    @classmethod
+    def student_ids_on(cls, day: dt) -> Set[int]:
+        """Ids of the students marked on `day`"""
+        rows = Session.query(cls.student_id).filter(cls.day == day).all()
+        return {student_id for student_id, in rows}
+
     @classmethod
     def is_marked(cls, date: dt, student: StudentModel) -> bool:
         date_only = date.date()  # Extract only date part from datetime
-        marked = Session.query(cls).filter(
-            func.date(cls.date) == date_only,
+        marked = Session.query(cls.id).filter(
+            cls.day == date_only,
             cls.student_id == student.id
         ).first()
         return marked is not None
 
+    @classmethod
+    def mark_once(cls, student_id: int, at: dtime) -> bool:
+        """
+        Insert an attendance of the student at `at` unless the student is marked that day already or
+        does not exist anymore, returns whether it was inserted. The check and the insert are one
+        statement and (student_id, day) is unique, so two writers cannot both insert. The caller commits.
+        """
+        marked = Session.query(cls.id).filter(cls.student_id == student_id, cls.day == at.date()).exists()
+        student = Session.query(StudentModel.id).filter(StudentModel.id == student_id).exists()
+        row = Session.query(
+            literal(at, cls.date.type), literal(at.date(), cls.day.type), literal(student_id, Integer)
+        ).filter(student, ~marked)
+        # the mark of a writer of another process committed in the meantime is ignored too,
+        # rather than failing the writer's whole transaction on the unique constraint
+        if engine.dialect.name == "postgresql":
+            statement = postgresql.insert(cls.__table__).from_select(["date", "day", "student_id"], row.statement)
+            statement = statement.on_conflict_do_nothing(index_elements=["student_id", "day"])
+        else:
+            statement = cls.__table__.insert().from_select(["date", "day", "student_id"], row.statement)
+            statement = statement.prefix_with("OR IGNORE", dialect="sqlite")
+        return Session.execute(statement).rowcount > 0
+
     def save_to_db(self) -> None:
         Session.add(self)
         Session.commit()
@@ -145,6 +232,16 @@ class AttendanceModel(Base):
 
 
 
+class SettingsValues(NamedTuple):
+    """Plain copy of the settings, safe to share between threads and sessions"""
+    start_time: time
+    end_time: time
+    late_count: int  # minutes after `start_time` a student is late
+
+    def late_after(self, day: dt) -> dtime:
+        return dtime.combine(day, self.start_time) + timedelta(minutes=self.late_count)
+
+
 class Settings(Base):
     __tablename__ = "settings"
 
@@ -153,6 +250,9 @@ class Settings(Base):
     end_time = Column(Time, nullable=False)
     late_count = Column(Integer, nullable=False)
 
+    # values of the current settings, loaded on first use and dropped by `update_settings`
+    cache = None  # type: Optional[SettingsValues]
+
     @classmethod
     def find_by_id(cls, _id: int) -> "Settings":
         return Session.query(cls).filter_by(id=_id).first()
@@ -166,6 +266,17 @@ class Settings(Base):
         """Get the first settings record (typically there's only one)"""
         return cls.find_by_id(1)
 
+    @classmethod
+    def cached(cls) -> Optional[SettingsValues]:
+        """Values of the current settings without a query, None if there are no settings"""
+        values = cls.cache
+        if values is None:
+            setting = cls.get_current_settings()
+            if setting is None:
+                return None
+            values = cls.cache = SettingsValues(setting.start_time, setting.end_time, setting.late_count)
+        return values
+
     @classmethod
     def update_settings(cls, _id: int, start_time: str, end_time: str, late_count: int) -> "Settings":
         setting = cls.find_by_id(_id)
@@ -181,6 +292,7 @@ class Settings(Base):
                 setting.end_time = end_time
                 setting.late_count = int(late_count)
                 Session.commit()
+                cls.cache = None
                 return setting
             except ValueError as e:
                 Session.rollback()
@@ -222,6 +334,8 @@ class VideoFeedModel(Base):
     id = Column(String(30), nullable=False, primary_key=True)
     is_active = Column(Boolean, default=False)
     url = Column(String, nullable=False)
+    detector = Column(String(10), nullable=True)  # face detector of the feed, FACE_DETECTOR when not set
+    roi = Column(JSON, nullable=True)  # [[[x, y], ...], ...] polygons as fractions of the frame, whole frame if not set
 
     @classmethod
     def find_by_id(cls, _id: str) -> "VideoFeedModel":
@@ -243,5 +357,36 @@ class VideoFeedModel(Base):
         Session.delete(self)
         Session.commit()
 
-Base.metadata.create_all(engine)
-Settings.initialize_default_settings()
\ No newline at end of file
+def add_missing_columns(model) -> None:
+    """create_all() does not alter existing tables, add the nullable columns added to `model` since"""
+    existing = {column["name"] for column in inspect(engine).get_columns(model.__tablename__)}
+    with engine.begin() as connection:
+        for column in model.__table__.columns:
+            if column.name not in existing and column.nullable:
+                connection.execute(text(
+                    f"ALTER TABLE {model.__tablename__} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                ))
+
+
+def needs_attendance_migration() -> bool:
+    """Whether the attendances table still has the schema keyed by `date` only"""
+    columns = {column["name"] for column in inspect(engine).get_columns(AttendanceModel.__tablename__)}
+    return "day" not in columns
+
+
+def require_attendance_schema() -> None:
+    """Refuse to start an app on the old attendances table, every attendance query needs `day`"""
+    if needs_attendance_migration():
+        raise SystemExit(
+            "[ERROR] the attendances table has the old schema, convert it with `python run_migrate_attendance.py`"
+        )
+
+
+def init_db() -> None:
+    """
+    Create the missing tables and columns and the default settings. Called by the entry points rather than
+    on import, so processes spawned by the worker pools import the models without touching the database.
+    """
+    Base.metadata.create_all(engine)
+    add_missing_columns(VideoFeedModel)
+    Settings.initialize_default_settings()
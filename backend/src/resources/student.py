@@ -1,6 +1,5 @@
 import os
 import shutil
-import pickle
 
 from flask import request
 from flask_restful import Resource
@@ -9,11 +8,12 @@ from flask_jwt_extended import jwt_required
 
 from src.db import Session
 from src.libs import image_helper
-from src.libs.train_classifier import TrainClassifier
+from src.libs.presence import presence
+from src.libs.training_queue import TrainingQueue
 from src.libs.strings import gettext
 from src.models import StudentModel
 from src.schemas import StudentSchema, ImageSchema
-from src.settings import DATASET_PATH, ENCODINGS_FILE
+from src.settings import DATASET_PATH
 
 
 student_schema = StudentSchema()
@@ -56,30 +56,18 @@ class StudentDelete(Resource):
         student = StudentModel.find_by_id(student_id)
         if student:
             student.delete_from_db()
+            # recognizers of this process stop naming and marking the student right away
+            presence.forget(student_id)
             # delete the folder containing images of student in the dataset
             id_path = os.path.join(DATASET_PATH, str(student_id))
             if os.path.exists(id_path):
                 shutil.rmtree(id_path)
-            # remove student training data
-            ids = []
-            encodings = []
-            try:
-                print("[INFO] loading encodings...")
-                data = pickle.loads(open(ENCODINGS_FILE, "rb").read())
-                # initialize the list of known encodings and known names
-                known_encodings = data["encodings"]
-                known_ids = data["ids"]
-                for index in range(len(known_ids)):
-                    if known_ids[index] != student_id:
-                        ids.append(known_ids[index])
-                        encodings.append(known_encodings[index])
-                data = {"encodings": encodings, "ids": ids}
-                f = open(ENCODINGS_FILE, "wb")
-                f.write(pickle.dumps(data))
-                f.close()
-            except FileNotFoundError:
-                pass
-            return {"message": gettext('student_deleted').format(student.name, student.id)}, 200
+            # remove student training data in the background
+            job = TrainingQueue.submit(remove_student=student_id)
+            return {
+                "message": gettext('student_deleted').format(student.name, student.id),
+                "job_id": job.id
+            }, 200
 
         return {"message": gettext('student_not_found')}, 404
 
@@ -104,6 +92,6 @@ class StudentCapture(Resource):
             extension = image_helper.get_extension(data["image"])
             return {"message": gettext("image_illegal_extension").format(extension)}, 400
 
-        # train images when submitted successfully
-        TrainClassifier.train()
-        return {"message": gettext("image_uploaded").format(basename)}, 201
+        # queue training of the uploaded image only when submitted successfully
+        job = TrainingQueue.submit([image_helper.get_path(image_path)])
+        return {"message": gettext("image_uploaded").format(basename), "job_id": job.id}, 201
@@ -0,0 +1,17 @@
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required
+
+from src.libs.strings import gettext
+from src.libs.training_queue import TrainingQueue
+
+
+class TrainingJobStatus(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls, job_id: str):
+        """Status and timings of a training job returned by the upload and delete endpoints"""
+        job = TrainingQueue.find_by_id(job_id)
+        if job:
+            return job.to_dict(), 200
+
+        return {"message": gettext('training_job_not_found')}, 404
@@ -6,6 +6,10 @@ from src.db import Session
 from src.libs.strings import gettext
 from src.models import VideoFeedModel
 from src.schemas import VideoFeedSchema
+from src.libs.attendance_writer import AttendanceWriter
+from src.libs.face_quality import FaceQualityGate
+from src.libs.roi import RegionOfInterest
+from src.libs.scheduler import FrameScheduler
 from src.libs.web_utils import RecognitionCamera
 
 
@@ -34,6 +38,21 @@ class VideoFeed(Resource):
         return {"message": gettext('video_feed_not_found')}, 404
 
 
+class VideoFeedStats(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls):
+        """
+        Target, scheduled and observed analysis FPS of every running feed, faces rejected before encoding
+        and attendances written
+        """
+        return {
+            "feeds": FrameScheduler.stats_all(),
+            "face_quality": FaceQualityGate.stats(),
+            "attendance_writer": AttendanceWriter.stats()
+        }, 200
+
+
 # TODO: make this get() to work with @jwt_required by sending response with Flask-RESTful instead of Response()
 class VideoFeedPreview(Resource):
     @classmethod
@@ -54,6 +73,8 @@ class VideoFeedPreview(Resource):
         elif feed_url == "4":
             feed_url = 4
         camera_stream.set_video_source(feed_url)
+        camera_stream.set_detector(feed_id, video_feed.detector)
+        camera_stream.set_roi(feed_id, video_feed.roi)
         if video_feed:
             resp = Response(
                 cls.gen_frame(camera_stream(unique_id=feed_id)),
@@ -74,6 +95,39 @@ class VideoFeedPreview(Resource):
             )  # concat frame one by one and show result
 
 
+class VideoFeedRoi(Resource):
+    """Region of interest of a feed: `{"roi": [[[x, y], ...], ...]}` polygons as fractions of the frame"""
+    @classmethod
+    @jwt_required
+    def get(cls, feed_id: str):
+        video_feed = VideoFeedModel.find_by_id(feed_id)
+        if video_feed:
+            return {"roi": video_feed.roi}, 200
+
+        return {"message": gettext('video_feed_not_found')}, 404
+
+    @classmethod
+    @jwt_required
+    def put(cls, feed_id: str):
+        video_feed = VideoFeedModel.find_by_id(feed_id)
+        if not video_feed:
+            return {"message": gettext('video_feed_not_found')}, 404
+
+        try:
+            roi = RegionOfInterest.validate((request.get_json() or {}).get("roi"))
+        except ValueError as e:
+            return {"message": gettext('video_feed_roi_invalid').format(e)}, 400
+
+        try:
+            video_feed.roi = roi
+            video_feed.save_to_db()
+        except:
+            return {"message": gettext('internal_server_error')}, 500
+        # a running feed switches to the new region from its next frame
+        RecognitionCamera.set_roi(feed_id, roi)
+        return {"message": gettext('video_feed_roi_updated'), "roi": roi}, 200
+
+
 # TODO: VideoFeedAdd Resource
 class VideoFeedAdd(Resource):
     """Adds a video feed to `feeds` table in the database"""
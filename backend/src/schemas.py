@@ -1,11 +1,13 @@
 from typing import Union, Any, Optional, Mapping
 from werkzeug.datastructures import FileStorage
 
-from marshmallow import Schema, fields
-from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+from marshmallow import Schema, ValidationError, fields, validate
+from marshmallow_sqlalchemy import SQLAlchemyAutoSchema, auto_field
 from marshmallow_sqlalchemy.fields import Nested
 
 from src.models import TeacherModel, StudentModel, AttendanceModel, VideoFeedModel
+from src.libs.detectors import FACE_DETECTORS
+from src.libs.roi import RegionOfInterest
 
 
 class TeacherSchema(SQLAlchemyAutoSchema):
@@ -28,19 +30,28 @@ class AttendanceSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = AttendanceModel
         # load_only = ()  # during deserialization dictionary -> object
-        dump_only = ("date", "student")  # during serialization object -> dictionary
+        dump_only = ("id", "date", "day", "student")  # during serialization object -> dictionary
         load_instance = True  # Optional: deserialize to object/model instances
     student = Nested(
         StudentSchema
     )
 
 
+def validate_roi(value) -> None:
+    try:
+        RegionOfInterest.validate(value)
+    except ValueError as e:
+        raise ValidationError(str(e))
+
+
 class VideoFeedSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = VideoFeedModel
         # load_only = ()  # during deserialization dictionary -> object
         dump_only = ("is_active",)  # during serialization object -> dictionary
         load_instance = True  # Optional: deserialize to object/model instances
+    detector = auto_field(validate=validate.OneOf(FACE_DETECTORS))
+    roi = fields.Raw(allow_none=True, validate=validate_roi)
 
 
 class FileStorageField(fields.Field):
@@ -21,5 +21,98 @@ CAFFEMODEL_PATH = os.path.join("files", "detectors", "res10_300x300_ssd_iter_140
 
 
 DLIB_MODEL = "hog"  # hog -> faster but less accurate, cnn -> more accurate but slower
+# face detector of the live pipelines (feeds may pick their own) and of training:
+# hog / cnn -> dlib, haar -> OpenCV Haar cascade, ssd -> OpenCV DNN res10 SSD (needs CAFFEMODEL_PATH),
+# cascade -> CASCADE_PROPOSER over the frame then CASCADE_CONFIRMER around its proposals only
+FACE_DETECTOR = config('FACE_DETECTOR', default=DLIB_MODEL)
+TRAIN_DETECTOR = config('TRAIN_DETECTOR', default=DLIB_MODEL)
+SSD_CONFIDENCE = config('SSD_CONFIDENCE', default=0.5, cast=float)
+CASCADE_PROPOSER = config('CASCADE_PROPOSER', default="haar")  # haar or ssd
+CASCADE_CONFIRMER = config('CASCADE_CONFIRMER', default=DLIB_MODEL)  # hog or cnn
+CASCADE_PADDING = config('CASCADE_PADDING', default=0.5, cast=float)  # context around proposals, share of their size
 DLIB_TOLERANCE = 0.6  # 0.6 -> default, 0.72 -> strict
-ENCODINGS_FILE = os.path.join("files", "encodings.pickle")
+MATCH_STRATEGY = config('MATCH_STRATEGY', default="vote")  # vote -> most matched samples, nearest -> closest sample
+ENCODINGS_FILE = os.path.join("files", "encodings.bin")
+ENCODINGS_DTYPE = config('ENCODINGS_DTYPE', default="float32")  # float32 or float16 (half the size)
+LEGACY_ENCODINGS_FILE = os.path.join("files", "encodings.pickle")  # migrated to ENCODINGS_FILE on first load
+TRAIN_MANIFEST_FILE = os.path.join("files", "train_manifest.json")  # images already encoded into ENCODINGS_FILE
+TRAIN_WORKERS = config('TRAIN_WORKERS', default=1, cast=int)  # encoding processes, 0 -> one per core
+TRAIN_MAX_IN_FLIGHT = config('TRAIN_MAX_IN_FLIGHT', default=4, cast=int)  # queued images per worker
+
+GALLERY_POLL_SECONDS = config('GALLERY_POLL_SECONDS', default=2.0, cast=float)  # how often recognizers check for new encodings
+
+# brute -> exact linear scan, kdtree -> KD tree (exact with eps=0), ivf -> k-means coarse quantized lists,
+# quantized -> scan of a float16/int8 copy in RAM, candidates re-ranked in float32 (keep ENCODINGS_DTYPE float32)
+FACE_INDEX = config('FACE_INDEX', default="brute")
+FACE_INDEX_FILE = os.path.join("files", "face_index.npz")
+FACE_INDEX_K = config('FACE_INDEX_K', default=32, cast=int)  # nearest samples that vote with kdtree/ivf
+KDTREE_EPS = config('KDTREE_EPS', default=0.0, cast=float)
+IVF_LISTS = config('IVF_LISTS', default=0, cast=int)  # 0 -> sqrt(number of encodings)
+IVF_NPROBE = config('IVF_NPROBE', default=8, cast=int)
+QUANTIZATION = config('QUANTIZATION', default="int8")  # int8 -> 4x smaller than float32, float16 -> 2x
+QUANTIZED_CANDIDATES = config('QUANTIZED_CANDIDATES', default=64, cast=int)  # coarse hits re-ranked exactly
+
+# compacted gallery of at most K prototypes per student, 0 -> disabled
+PROTOTYPES_PER_STUDENT = config('PROTOTYPES_PER_STUDENT', default=0, cast=int)
+PROTOTYPE_METHOD = config('PROTOTYPE_METHOD', default="medoid")  # medoid -> real samples, kmeans -> centroids
+PROTOTYPE_RERANK_MARGIN = config('PROTOTYPE_RERANK_MARGIN', default=0.08, cast=float)  # re-rank band around tolerance
+PROTOTYPES_FILE = os.path.join("files", "prototypes.bin")
+
+# width frames are resized to before face detection (0 -> full resolution) and dlib upsample count of the
+# detector, faces smaller than ~80px / 2^upsample in the resized frame are missed
+CAMERA_DETECT_WIDTH = config('CAMERA_DETECT_WIDTH', default=750, cast=int)
+CAMERA_DETECT_UPSAMPLE = config('CAMERA_DETECT_UPSAMPLE', default=1, cast=int)
+CLIENT_DETECT_WIDTH = config('CLIENT_DETECT_WIDTH', default=640, cast=int)
+CLIENT_DETECT_UPSAMPLE = config('CLIENT_DETECT_UPSAMPLE', default=1, cast=int)
+CLIENT_DECODE_WIDTH = config('CLIENT_DECODE_WIDTH', default=1280, cast=int)  # larger client JPEGs are decoded reduced
+CLI_DETECT_WIDTH = config('CLI_DETECT_WIDTH', default=0, cast=int)
+CLI_DETECT_UPSAMPLE = config('CLI_DETECT_UPSAMPLE', default=1, cast=int)
+
+# cross-frame face tracking, a tracked face is encoded again only when new, changed or every N frames
+TRACKING = config('TRACKING', default=True, cast=bool)
+TRACK_IOU = config('TRACK_IOU', default=0.3, cast=float)  # min overlap of a detection with a track
+TRACK_REENCODE_FRAMES = config('TRACK_REENCODE_FRAMES', default=30, cast=int)
+TRACK_MIN_CONFIDENCE = config('TRACK_MIN_CONFIDENCE', default=0.5, cast=float)  # decays with the overlap of every frame
+TRACK_MAX_MISSED = config('TRACK_MAX_MISSED', default=5, cast=int)  # frames without detection before a track is dropped
+TRACK_OPTICAL_FLOW = config('TRACK_OPTICAL_FLOW', default=False, cast=bool)  # move tracks with Lucas-Kanade flow
+
+# per stream frame scheduling, frames are analysed at up to ANALYSIS_TARGET_FPS while an analysis takes less than
+# ANALYSIS_LATENCY_BUDGET seconds and the stream spends at most ANALYSIS_MAX_LOAD of its time analysing,
+# an overloaded stream skips more frames and lowers its detection scale down to ANALYSIS_MIN_SCALE
+ANALYSIS_TARGET_FPS = config('ANALYSIS_TARGET_FPS', default=5.0, cast=float)
+ANALYSIS_LATENCY_BUDGET = config('ANALYSIS_LATENCY_BUDGET', default=0.25, cast=float)
+ANALYSIS_MAX_LOAD = config('ANALYSIS_MAX_LOAD', default=0.5, cast=float)
+ANALYSIS_MIN_SCALE = config('ANALYSIS_MIN_SCALE', default=0.5, cast=float)
+
+# inline -> feeds run recognition on their camera thread, pool -> capture and preview run at camera FPS while
+# recognition runs on a process pool shared by every feed of the process, service -> like pool but the faces of
+# every feed and socket client are encoded and matched in micro-batches by run_recognition_service.py
+RECOGNITION_BACKEND = config('RECOGNITION_BACKEND', default="pool")
+RECOGNITION_WORKERS = config('RECOGNITION_WORKERS', default=0, cast=int)  # 0 -> one per core
+RECOGNITION_SERVICE_ADDRESS = config('RECOGNITION_SERVICE_ADDRESS', default=os.path.join("files", "recognition.sock"))
+RECOGNITION_SERVICE_AUTHKEY = config('RECOGNITION_SERVICE_AUTHKEY', default="attendance-system")
+RECOGNITION_BATCH_SIZE = config('RECOGNITION_BATCH_SIZE', default=64, cast=int)  # max faces of a micro-batch
+RECOGNITION_BATCH_WAIT_MS = config('RECOGNITION_BATCH_WAIT_MS', default=10.0, cast=float)  # max wait to fill it
+RECOGNITION_SERVICE_TIMEOUT = config('RECOGNITION_SERVICE_TIMEOUT', default=2.0, cast=float)  # s, then fall back
+
+# motion gating, a stream skips detection while its frames do not change from the last analysed one
+MOTION_GATE = config('MOTION_GATE', default=True, cast=bool)
+MOTION_WIDTH = config('MOTION_WIDTH', default=160, cast=int)  # frames are compared at this width
+MOTION_THRESHOLD = config('MOTION_THRESHOLD', default=25, cast=int)  # gray level change of a changed pixel
+MOTION_MIN_AREA = config('MOTION_MIN_AREA', default=0.002, cast=float)  # share of changed pixels, lower -> more sensitive
+MOTION_REFRESH_SECONDS = config('MOTION_REFRESH_SECONDS', default=10.0, cast=float)  # analyse anyway after this long
+
+# face quality gate between detection and encoding, live and in training
+FACE_QUALITY_GATE = config('FACE_QUALITY_GATE', default=True, cast=bool)
+FACE_MIN_SIZE = config('FACE_MIN_SIZE', default=40, cast=int)  # px of the shorter box side in the full frame
+FACE_MIN_SHARPNESS = config('FACE_MIN_SHARPNESS', default=30.0, cast=float)  # variance of the Laplacian at 96x96
+FACE_MIN_BRIGHTNESS = config('FACE_MIN_BRIGHTNESS', default=40, cast=int)  # mean gray level of the face
+FACE_MAX_BRIGHTNESS = config('FACE_MAX_BRIGHTNESS', default=220, cast=int)
+FACE_MAX_YAW = config('FACE_MAX_YAW', default=0.4, cast=float)  # nose offset / eye distance, 0 -> not checked
+
+# attendance writer, marks of every recognizer are written by one background thread
+ATTENDANCE_BATCH_SIZE = config('ATTENDANCE_BATCH_SIZE', default=100, cast=int)  # max marks of one transaction
+ATTENDANCE_COMMIT_DELAY_MS = config('ATTENDANCE_COMMIT_DELAY_MS', default=50.0, cast=float)  # wait for more marks
+ATTENDANCE_RETRY_MAX_SECONDS = config('ATTENDANCE_RETRY_MAX_SECONDS', default=60.0, cast=float)  # backoff cap
+DASHBOARD_DEFAULT_DAYS = config('DASHBOARD_DEFAULT_DAYS', default=1, cast=int)  # history without ?from=, 1 = today
+PRESENCE_POLL_SECONDS = config('PRESENCE_POLL_SECONDS', default=1.0, cast=float)  # day and gallery version checks
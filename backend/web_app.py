@@ -5,105 +5,87 @@ from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 import cv2
 import jwt
-import numpy as np
-import face_recognition
-import pickle
 import base64
 from datetime import datetime as dt
 import datetime as ds
-from src.models import Settings, StudentModel, AttendanceModel, TeacherModel
+from src.models import Settings, StudentModel, TeacherModel, init_db, require_attendance_schema
+from src.libs.attendance_writer import AttendanceWriter
+from src.libs.face_quality import FaceQualityGate
+from src.libs.gallery import Gallery
+from src.libs.presence import presence
+from src.libs.recognition import RecognitionEngine, decode_frame
+from src.libs.recognition_service import RecognitionServiceClient
+from src.libs.scheduler import FrameScheduler
+from src.libs.tracker import FaceTracker
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 from src.settings import (
     DATASET_PATH,
     HAAR_CASCADE_PATH,
-    DLIB_MODEL,
-    DLIB_TOLERANCE,
-    ENCODINGS_FILE
+    CLIENT_DETECT_WIDTH,
+    CLIENT_DETECT_UPSAMPLE,
+    CLIENT_DECODE_WIDTH,
+    CLI_DETECT_WIDTH,
+    CLI_DETECT_UPSAMPLE,
+    RECOGNITION_BACKEND,
+    TRACKING,
+    DASHBOARD_DEFAULT_DAYS
 )
 load_dotenv()
 SERVER_PORT = int(os.getenv("SERVER_PORT", 5000))
 # ====== Flask App Setup ======
 app = Flask(__name__)
-CORS(app,supports_credentials=True,methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],)
+CORS(app,supports_credentials=True,methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],expose_headers=["X-Next-After"])
 
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# ====== Load Known Encodings from Pickle File ======
-with open(ENCODINGS_FILE, "rb") as file:
-    data = pickle.loads(file.read())
-    known_encodings = data["encodings"]
-    known_ids = data["ids"]
-    print("[INFO] Face encodings loaded successfully.")
-
-# ====== Helper: Face Recognition & Attendance ======
-def recognize_faces_and_mark_attendance(encodings):
-    names = []
-    known_students = {}
-
-    for encoding in encodings:
-        matches = face_recognition.compare_faces(known_encodings, encoding, DLIB_TOLERANCE)
-        display_name = "Unknown"
-
-        if True in matches:
-            matched_indexes = [i for (i, b) in enumerate(matches) if b]
-            counts = {}
-
-            for matched_index in matched_indexes:
-                _id = known_ids[matched_index]
-                counts[_id] = counts.get(_id, 0) + 1
-
-            _id = max(counts, key=counts.get)
-            if _id:
-                if _id in known_students:
-                    student = known_students[_id]
-                else:
-                    student = StudentModel.find_by_id(_id)
-                    known_students[_id] = student
-
-                if not AttendanceModel.is_marked(dt.today(), student):
-                    student_attendance = AttendanceModel(student=student)
-                    student_attendance.save_to_db()
-
-                display_name = student.name
-
-        names.append(display_name)
-
-    return names
+# create database tables, the attendance queries need the migrated schema
+init_db()
+require_attendance_schema()
+
+# ====== Load Known Encodings (reloaded automatically after training) ======
+Gallery.current()
+print("[INFO] Face encodings loaded successfully.")
+# students already marked today and student names, kept up to date by a background thread
+presence.refresh()
+presence.start()
+
+# ====== Face Recognition & Attendance ======
+# unknown faces are shown to the client too
+client_engine = RecognitionEngine(detect_width=CLIENT_DETECT_WIDTH, upsample=CLIENT_DETECT_UPSAMPLE,
+                                  draw_unknown=True, name="client")
+if RECOGNITION_BACKEND == "service":
+    # faces of every client are identified in micro-batches with the camera feeds
+    client_engine.identifier = RecognitionServiceClient(fallback=client_engine.identify)
+# every connected client streams its own frames, so each one gets its own face tracker and scheduler
+client_trackers = {}
+client_schedulers = {}
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    client_trackers.pop(request.sid, None)
+    client_schedulers.pop(request.sid, None)
+    FrameScheduler.remove(f"client-{request.sid}")
 
 # ====== Handle Incoming Frame from Client (binary) ======
 @socketio.on('client_frame')
 def handle_client_frame(data):
     try:
-        # Decode bytes -> numpy array
-        np_arr = np.frombuffer(data, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        # Decode bytes -> numpy array, oversized frames are decoded at a reduced size
+        frame = decode_frame(data, CLIENT_DECODE_WIDTH)
 
         if frame is None:
             print("[ERROR] Frame decoding failed.")
             return
 
-        # Convert BGR to RGB
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        r = frame.shape[1] / float(rgb.shape[1])
-
-        # Face detection and encoding
-        boxes = face_recognition.face_locations(rgb, model=DLIB_MODEL)
-        encodings = face_recognition.face_encodings(rgb, boxes)
-
-        # Face recognition and attendance marking
-        names = recognize_faces_and_mark_attendance(encodings)
+        # Face detection, recognition and attendance marking
+        tracker = client_trackers.setdefault(request.sid, FaceTracker()) if TRACKING else None
+        if request.sid not in client_schedulers:
+            client_schedulers[request.sid] = FrameScheduler.for_stream(f"client-{request.sid}")
+        faces = client_engine.process_stream(frame, tracker, client_schedulers[request.sid])
 
         # Draw bounding boxes and names
-        for ((top, right, bottom, left), name) in zip(boxes, names):
-            top = int(top * r)
-            right = int(right * r)
-            bottom = int(bottom * r)
-            left = int(left * r)
-
-            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-            y = top - 15 if top - 15 > 15 else top + 15
-            cv2.putText(frame, str(name), (left, y), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
+        client_engine.annotate(frame, faces)
 
         # Encode frame back to JPEG
         success, buffer = cv2.imencode('.jpg', frame)
@@ -126,29 +108,17 @@ class VideoAttendanceRecognizer:
     def recognize_n_attendance(self):
         print("[INFO] Starting video stream...")
         cap = cv2.VideoCapture(self.input_video)
-        known_students = {}
+        engine = RecognitionEngine(detect_width=CLI_DETECT_WIDTH, upsample=CLI_DETECT_UPSAMPLE, name="cli")
+        tracker = FaceTracker() if TRACKING else None
+        scheduler = FrameScheduler.for_stream(self.app_title)
 
         while True:
             ret, img = cap.read()
             if not ret:
                 break
 
-            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            r = img.shape[1] / float(rgb.shape[1])
-            boxes = face_recognition.face_locations(rgb, model=DLIB_MODEL)
-            encodings = face_recognition.face_encodings(rgb, boxes)
-            names = recognize_faces_and_mark_attendance(encodings)
-
-            for ((top, right, bottom, left), display_name) in zip(boxes, names):
-                if display_name == "Unknown":
-                    continue
-                top = int(top * r)
-                right = int(right * r)
-                bottom = int(bottom * r)
-                left = int(left * r)
-                cv2.rectangle(img, (left, top), (right, bottom), (0, 255, 0), 2)
-                y = top - 15 if top - 15 > 15 else top + 15
-                cv2.putText(img, display_name, (left, y), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
+            faces = engine.process_stream(img, tracker, scheduler)
+            engine.annotate(img, faces)
 
             cv2.imshow(f"Recognizing Faces - {self.app_title}", img)
             if cv2.waitKey(100) & 0xFF == 27:
@@ -187,33 +157,52 @@ def token_required(f):
 @app.route('/dashboard',methods=['GET'])
 @token_required
 def dashboard():
+    # optional filters: ?from=YYYY-MM-DD&to=YYYY-MM-DD&student_id=1&student_id=2
+    # and keyset pagination: ?limit=100&after=<id of the last student of the previous page>
+    # without dates only the last DASHBOARD_DEFAULT_DAYS days are returned, not the whole history
+    try:
+        start = dt.strptime(request.args["from"], "%Y-%m-%d").date() if "from" in request.args else None
+        end = dt.strptime(request.args["to"], "%Y-%m-%d").date() if "to" in request.args else None
+        after = int(request.args["after"]) if "after" in request.args else None
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+        student_ids = [int(student_id) for student_id in request.args.getlist("student_id")]
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {str(e)}"}), 400
+    if limit is not None and limit < 1:
+        return jsonify({"error": "Invalid filter: limit must be positive"}), 400
+    if start is None and end is None:
+        start = ds.date.today() - ds.timedelta(days=DASHBOARD_DEFAULT_DAYS - 1)
 
-    students=StudentModel.find_all()
-    attendances = AttendanceModel.find_all()
     all_info = []
-    for student in students:
-        # print(student.name)
-        date_time = {
-            "dates": []
-        }
-
-        for attendance in attendances:
-            if student.id == attendance.student_id:
-                date_time["dates"].append({
-                    "attendance_date": attendance.date.strftime("%Y-%m-%d"),
-                    "time":attendance.date.strftime("%I-%M-%p")
-                })
-        student_data = {
-            "id": student.id,
-            "name": student.name,
-            "date_time": date_time
-        }
-        
-        all_info.append(student_data)
-    print(all_info)
+    for student_id, name, date in StudentModel.attendance_history(after, limit, start, end, student_ids):
+        # rows come ordered by student, so a student's rows are consecutive
+        if not all_info or all_info[-1]["id"] != student_id:
+            all_info.append({
+                "id": student_id,
+                "name": name,
+                "date_time": {
+                    "dates": []
+                }
+            })
+        if date is not None:
+            all_info[-1]["date_time"]["dates"].append({
+                "attendance_date": date.strftime("%Y-%m-%d"),
+                "time": date.strftime("%I-%M-%p")
+            })
     student_json = jsonify(all_info)
-    # print(student_json)
+    if limit is not None and len(all_info) == limit:
+        # cursor of the next page
+        student_json.headers["X-Next-After"] = str(all_info[-1]["id"])
     return student_json, 200
+# per stream analysis rates
+@app.route('/streams/stats', methods=['GET'])
+@token_required
+def stream_stats():
+    return jsonify({
+        "streams": FrameScheduler.stats_all(),
+        "face_quality": FaceQualityGate.stats(),
+        "attendance_writer": AttendanceWriter.stats()
+    }), 200
 # profile
 @app.route('/profiles',methods=['GET'])
 @token_required
@@ -233,49 +222,33 @@ def profile():
 @app.route('/time_logs', methods=['GET'])
 @token_required
 def time_logs():
-    students = StudentModel.find_all()
-    attendances = AttendanceModel.find_all()
-    setting = Settings.find_all()[0]
+    setting = Settings.cached()
+    today = ds.date.today()
 
     all_info = []
 
-    # Threshold time: start_time + late_count minutes
-    threshold_time = (ds.datetime.combine(ds.date.today(), setting.start_time) +
-                      ds.timedelta(minutes=setting.late_count)).time()
-
-    today = ds.date.today()
-
-    for student in students:
-        date_time = {
-            "dates": []
-        }
-        status = "--"  # Default
-
-        for attendance in attendances:
-            if student.id == attendance.student_id and attendance.date.date() == today:
-                attend_time = attendance.date.time()
-                if attend_time > threshold_time:
-                    status = "late"
-                else:
-                    status = "on time"
-                
-                date_time["dates"].append({
-                    "attendance_date": attendance.date.strftime("%Y-%m-%d"),
-                    "time": attendance.date.strftime("%H:%M:%p")
-                })
-                break  # No need to check more attendance records for today
-
-        # If the student has no attendance for today
-        if not date_time["dates"]:
-            date_time["dates"].append({
+    # Threshold time: start_time + late_count minutes, compared in the query
+    for student_id, name, date, late in StudentModel.status_on(today, setting.late_after(today)):
+        if date is None:
+            # the student has no attendance for today
+            status = "--"
+            dates = [{
                 "attendance_date": "--",
                 "time": "--"
-            })
+            }]
+        else:
+            status = "late" if late else "on time"
+            dates = [{
+                "attendance_date": date.strftime("%Y-%m-%d"),
+                "time": date.strftime("%H:%M:%p")
+            }]
 
         student_data = {
-            "id": student.id,
-            "name": student.name,
-            "date_time": date_time,
+            "id": student_id,
+            "name": name,
+            "date_time": {
+                "dates": dates
+            },
             "status": status
         }
 
@@ -320,7 +293,7 @@ def update_settings():
 @app.route('/settings', methods=['GET'])
 @token_required
 def get_settings():
-    settings=Settings.find_by_id(1)
+    settings=Settings.cached()
     if settings:
         start_time_iso = settings.start_time.strftime("%H:%M")
         end_time_iso = settings.end_time.strftime("%H:%M")
@@ -368,9 +368,12 @@ function DashboardContent({ activeTab }: { activeTab: string }) {
         try {
           // const response = await axios.get("http://localhost:5000/dashboard");
 
+          // Filter for today's attendance
+          const today = new Date().toISOString().split("T")[0];
           const response = await axios.get(
             `${import.meta.env.VITE_API}/dashboard`,
             {
+              params: { from: today, to: today },
               withCredentials: true,
             }
           );
@@ -379,8 +382,6 @@ function DashboardContent({ activeTab }: { activeTab: string }) {
           setDashboarddata(data);
           setTotalstudent(data.length);
 
-          // Filter for today's attendance
-          const today = new Date().toISOString().split("T")[0];
           const filtered = data
             .filter((student: any) =>
               student.date_time?.dates?.some(
@@ -556,16 +557,17 @@ function AttendanceContent({
       navigate(`/attendance-system/attendance`);
       const fetchData = async () => {
         try {
+          const today = new Date().toISOString().split("T")[0];
           const response = await axios.get(
             `${import.meta.env.VITE_API}/dashboard`,
             {
+              params: { from: today, to: today },
               withCredentials: true,
             }
           );
           const data = response.data;
           console.log(data);
 
-          const today = new Date().toISOString().split("T")[0];
           console.log(today);
           const presentStudents = data
             .filter((student: any) =>